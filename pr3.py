@@ -1,22 +1,230 @@
+import asyncio
+import atexit
 import hashlib
+import os
+import mmap
 import time
 import json
 import base64
 import random
-from ecdsa import SigningKey, VerifyingKey, SECP256k1
+import sys
+import heapq
+import struct
+import tempfile
+import tracemalloc
+import functools
+import itertools
+import queue
+import socket
+import socketserver
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from collections import OrderedDict, deque
+from ecdsa import SigningKey, VerifyingKey, SECP256k1, BadSignatureError
+
+# Бінарний заголовок блоку: version, prevHash, timestamp, difficulty_target, MerkleRoot, а nonce - в кінці,
+# щоб незмінний префікс можна було загешувати один раз і далі лише копіювати стан sha256
+HEADER_PREFIX_STRUCT = struct.Struct(">8s32sd32s32s")
+MAX_VERSION_SIZE = 8
+NONCE_STRUCT = struct.Struct(">Q")
+HEADER_SIZE = HEADER_PREFIX_STRUCT.size + NONCE_STRUCT.size
+
+
+# Бінарний формат передачі між нодами: байт версії, далі поля; довжини та лічильники - varint
+WIRE_FORMAT_VERSION = 1
+TX_VALUES_STRUCT = struct.Struct(">dd32s")
+
+
+def hex_to_digest(value: str):
+    # "0" у генезис-блоці та "" для порожнього кореня Меркла стають нульовими 32 байтами
+    return bytes.fromhex(value.rjust(64, "0"))
+
+
+def encode_varint(value: int):
+    # Беззнаковий LEB128: 7 біт на байт, старший біт - ознака продовження
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def read_varint(view: memoryview, offset: int):
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(view):
+            raise ValueError("Truncated varint.")
+        byte = view[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _encode_field(data: bytes):
+    return encode_varint(len(data)) + data
+
+
+def _read_field(view: memoryview, offset: int):
+    length, offset = read_varint(view, offset)
+    # Зріз memoryview за межами даних мовчки повертає менше байтів - обрізане поле перевіряємо явно
+    if offset + length > len(view):
+        raise ValueError("Truncated field.")
+    return view[offset:offset + length], offset + length
+
+
+def _check_fully_read(view: memoryview, offset: int):
+    if offset != len(view):
+        raise ValueError(f"Unexpected {len(view) - offset} trailing bytes.")
+
+
+def _read_wire_version(view: memoryview):
+    # Повертає зсув першого поля після байта версії
+    if view[0] != WIRE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported wire format version: {view[0]}")
+    return 1
+
+
+class Metrics:
+    """Лічильники та гістограми тривалості для гарячих ділянок коду.
+
+    Поки метрики вимкнені, інструментовані методи - звичайні методи класів без жодних обгорток;
+    enable() підміняє їх обгортками, що міряють час виклику, disable() повертає оригінали.
+    Час вкладених викликів входить і в зовнішню метрику (наприклад, геш транзакції - у корінь Меркла).
+    """
+
+    def __init__(self):
+        # targets - (клас або модуль, ім'я атрибута, назва метрики)
+        self.targets = []
+        self.enabled = False
+        self.counters = {}
+        self.timings = {}
+        self._originals = []
+
+    def instrument(self, owner, attribute, name):
+        self.targets.append((owner, attribute, name))
+
+    def enable(self):
+        if self.enabled:
+            return
+        for owner, attribute, name in self.targets:
+            original = getattr(owner, attribute)
+            self._originals.append((owner, attribute, original))
+            setattr(owner, attribute, self._timed(name, original))
+        self.enabled = True
+
+    def disable(self):
+        for owner, attribute, original in reversed(self._originals):
+            setattr(owner, attribute, original)
+        self._originals = []
+        self.enabled = False
+
+    def reset(self):
+        self.counters = {}
+        self.timings = {}
+
+    def _timed(self, name, func):
+        observe = self.observe
+        perf_counter = time.perf_counter
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, perf_counter() - start)
+        return wrapper
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        # [кількість, сумарний час, максимум, гістограма]; кошик b - тривалість менша за 2^b мікросекунд
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0, 0.0, {}]
+        timing[0] += 1
+        timing[1] += seconds
+        if seconds > timing[2]:
+            timing[2] = seconds
+        bucket = int(seconds * 1e6).bit_length()
+        timing[3][bucket] = timing[3].get(bucket, 0) + 1
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "timings": {
+                name: {
+                    "count": count,
+                    "total_seconds": total,
+                    "mean_us": total / count * 1e6,
+                    "max_us": maximum * 1e6,
+                    "histogram_us": {f"<{1 << bucket}": hits for bucket, hits in sorted(histogram.items())},
+                }
+                for name, (count, total, maximum, histogram) in self.timings.items()
+            },
+        }
+
+    def export(self, path):
+        # Кожен знімок дописується рядком JSON, щоб порівнювати запуски між собою
+        with open(path, "a") as output_file:
+            output_file.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), **self.snapshot()}) + "\n")
+
+    def report(self):
+        for name, (count, total, maximum, _) in sorted(self.timings.items(), key=lambda item: -item[1][1]):
+            print(f"{name}: {count} викликів, {total * 1e3:.1f} мс, у середньому {total / count * 1e6:.1f} мкс, "
+                  f"максимум {maximum * 1e6:.0f} мкс")
+        for name, value in sorted(self.counters.items()):
+            print(f"{name}: {value}")
+
+
+METRICS = Metrics()
+METRICS_PATH = "metrics.jsonl"
+
 
 class Transaction:
+    # Без __dict__: геш зберігається як сирі 32 байти, адреси інтернуються і спільні для всіх транзакцій.
+    # Обчислений геш і бінарне кодування кешуються та скидаються при зміні будь-якого поля
+    __slots__ = ("input", "output", "amount", "txTimestamp", "digest", "signature", "_calculated_digest", "_encoded")
+
     def __init__(self, sender: str, receivers: list, amount: float):
-        self.input = sender
-        self.output = receivers
-        self.amount = amount
-        self.txTimestamp = time.time()
-        self.txHash = self.calculate_hash()
-        self.signature = None
+        # Кешів ще немає, тож поля записуються в обхід __setattr__
+        set_field = object.__setattr__
+        set_field(self, "input", sys.intern(sender))
+        set_field(self, "output", tuple(sys.intern(receiver) for receiver in receivers))
+        set_field(self, "amount", amount)
+        set_field(self, "txTimestamp", time.time())
+        set_field(self, "digest", self.calculate_digest())
+        set_field(self, "signature", None)
+        set_field(self, "_calculated_digest", self.digest)
+        set_field(self, "_encoded", None)
 
-    def calculate_hash(self):
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != "_":
+            object.__setattr__(self, "_calculated_digest", None)
+            object.__setattr__(self, "_encoded", None)
+
+    @property
+    def txHash(self):
+        return self.digest.hex()
+
+    @txHash.setter
+    def txHash(self, value: str):
+        self.digest = bytes.fromhex(value)
+
+    def calculate_digest(self):
         tx_string = f"{self.input}{'|'.join(self.output)}{self.amount}{self.txTimestamp}"
-        return hashlib.sha256(tx_string.encode()).hexdigest()
+        return hashlib.sha256(tx_string.encode()).digest()
+
+    def calculate_hash(self):
+        return self.calculate_digest().hex()
 
     def sign_transaction(self, private_key: SigningKey):
         if self.signature is not None:
@@ -27,22 +235,194 @@ class Transaction:
         return self.signature and public_key.verify(self.signature, self.txHash.encode())
 
     def verify_hash(self):
-        return self.txHash == self.calculate_hash()
+        if self._calculated_digest is None:
+            self._calculated_digest = self.calculate_digest()
+        return self.digest == self._calculated_digest
 
     def to_dict(self):
         return {
             "input": self.input,
-            "output": self.output,
+            "output": list(self.output),
             "amount": self.amount,
             "txTimestamp": self.txTimestamp,
             "txHash": self.txHash,
             "signature": base64.b64encode(self.signature).decode() if self.signature else None
         }
 
+    def encode(self):
+        if self._encoded is None:
+            parts = [_encode_field(self.input.encode()), encode_varint(len(self.output))]
+            parts.extend(_encode_field(receiver.encode()) for receiver in self.output)
+            parts.append(TX_VALUES_STRUCT.pack(self.amount, self.txTimestamp, self.digest))
+            parts.append(_encode_field(self.signature or b""))
+            self._encoded = b"".join(parts)
+        return self._encoded
+
+    def to_bytes(self):
+        return bytes([WIRE_FORMAT_VERSION]) + self.encode()
+
+    @classmethod
+    def read_from(cls, view: memoryview, offset: int):
+        # Поля читаються прямо з memoryview; копіюється лише підпис, бо ecdsa потребує bytes.
+        # Прочитані байти одразу стають кешованим кодуванням
+        tx = cls.__new__(cls)
+        set_field = object.__setattr__
+        start = offset
+        sender, offset = _read_field(view, offset)
+        receivers_count, offset = read_varint(view, offset)
+        receivers = []
+        for _ in range(receivers_count):
+            receiver, offset = _read_field(view, offset)
+            receivers.append(sys.intern(str(receiver, "utf-8")))
+        amount, tx_timestamp, digest = TX_VALUES_STRUCT.unpack_from(view, offset)
+        offset += TX_VALUES_STRUCT.size
+        signature, offset = _read_field(view, offset)
+        set_field(tx, "input", sys.intern(str(sender, "utf-8")))
+        set_field(tx, "output", tuple(receivers))
+        set_field(tx, "amount", amount)
+        set_field(tx, "txTimestamp", tx_timestamp)
+        set_field(tx, "digest", digest)
+        set_field(tx, "signature", bytes(signature) or None)
+        set_field(tx, "_calculated_digest", None)
+        set_field(tx, "_encoded", bytes(view[start:offset]))
+        return tx, offset
+
+    @classmethod
+    def from_bytes(cls, data):
+        view = memoryview(data)
+        tx, offset = cls.read_from(view, _read_wire_version(view))
+        _check_fully_read(view, offset)
+        return tx
+
     def __str__(self):
         return json.dumps(self.to_dict(), indent=4)
 
+
+@functools.lru_cache(maxsize=1024)
+def load_verifying_key(key_bytes: bytes):
+    # Розбір ключа (декодування точки кривої) робимо один раз на ключ у кожному процесі
+    return VerifyingKey.from_string(key_bytes, curve=SECP256k1)
+
+
+def _verify_signature_job(job):
+    message, signature, key_bytes = job
+    if signature is None:
+        return False
+    try:
+        return load_verifying_key(key_bytes).verify(signature, message)
+    except BadSignatureError:
+        return False
+
+
+_signature_pool = None
+
+
+def get_signature_pool(num_workers: int = None):
+    # Один пул на процес, створюється при першому виклику: процеси та їхній кеш load_verifying_key
+    # переживають окремі блоки. Розмір задає перший виклик
+    global _signature_pool
+    if _signature_pool is None:
+        _signature_pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+        atexit.register(_signature_pool.terminate)
+    return _signature_pool
+
+
+def verify_signatures_batch(items: list, num_workers: int = None, pool=None):
+    # items - пари (транзакція, публічний ключ); результат - список bool у тому ж порядку.
+    # Без pool використовується спільний пул get_signature_pool()
+    jobs = [(tx.txHash.encode(), tx.signature, public_key.to_string()) for tx, public_key in items]
+    num_workers = num_workers or multiprocessing.cpu_count()
+    if pool is None:
+        if num_workers == 1 or len(jobs) < 2:
+            return [_verify_signature_job(job) for job in jobs]
+        pool = get_signature_pool(num_workers)
+    return pool.map(_verify_signature_job, jobs, chunksize=max(1, len(jobs) // (4 * num_workers)))
+
+
+class MerkleTree:
+    def __init__(self, leaves: list = ()):
+        # levels[0] - геші транзакцій, levels[-1] - корінь; усі вузли зберігаються як сирі 32 байти
+        self.levels = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            nodes = self.levels[-1]
+            self.levels.append([self._parent(nodes, i) for i in range((len(nodes) + 1) // 2)])
+
+    @staticmethod
+    def _parent(nodes: list, index: int):
+        left = 2 * index
+        if left + 1 < len(nodes):
+            return hashlib.sha256(nodes[left] + nodes[left + 1]).digest()
+        return hashlib.sha256(nodes[left]).digest()
+
+    def append(self, leaf: bytes):
+        # Перераховуємо лише шлях від нового листа до кореня - O(log n) вузлів
+        self.levels[0].append(leaf)
+        index = len(self.levels[0]) - 1
+        level = 0
+        while len(self.levels[level]) > 1:
+            index //= 2
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+            upper = self.levels[level + 1]
+            parent = self._parent(self.levels[level], index)
+            if index < len(upper):
+                upper[index] = parent
+            else:
+                upper.append(parent)
+            level += 1
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def root(self):
+        return self.levels[-1][0] if self.levels[0] else None
+
+    def root_hex(self):
+        return self.root().hex() if self.levels[0] else ""
+
+    def get_proof(self, index: int):
+        # Доказ включення: (сусідній вузол, чи він зліва) для кожного рівня; None - вузол без пари
+        if not 0 <= index < len(self):
+            raise IndexError("Transaction index out of range.")
+        proof = []
+        for nodes in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(nodes):
+                proof.append((nodes[sibling], sibling < index))
+            else:
+                proof.append((None, False))
+            index //= 2
+        return proof
+
+    @staticmethod
+    def verify_proof(leaf: bytes, proof: list, root: bytes):
+        current = leaf
+        for sibling, sibling_is_left in proof:
+            if sibling is None:
+                current = hashlib.sha256(current).digest()
+            elif sibling_is_left:
+                current = hashlib.sha256(sibling + current).digest()
+            else:
+                current = hashlib.sha256(current + sibling).digest()
+        return current == root
+
+
 class Block:
+    # Геш блоку, префікс заголовка і бінарне кодування обчислюються один раз і кешуються; зміна поля скидає
+    # залежні кеші. Дерево Меркла порівнюється з поточними гешами транзакцій, а кодування - з кешованими
+    # кодуваннями транзакцій, тож зміна транзакції теж їх скидає. Транзакції додаються через add_transaction
+    # або заміною всього списку
+    _INVALIDATES = {
+        "version": ("_header_prefix", "_block_hash", "_wire_bytes"),
+        "prevHash": ("_header_prefix", "_block_hash", "_wire_bytes"),
+        "timestamp": ("_header_prefix", "_block_hash", "_wire_bytes"),
+        "difficulty_target": ("_header_prefix", "_block_hash", "_wire_bytes"),
+        "MerkleRoot": ("_header_prefix", "_block_hash", "_wire_bytes"),
+        "nonce": ("_block_hash", "_wire_bytes"),
+        "signature": ("_wire_bytes",),
+        "transactions": ("merkle_tree", "_wire_bytes"),
+    }
+
     def __init__(self, version: str, prev_hash: str, transactions: list, difficulty_target: int, nonce: int = 0):
         self.version = version
         self.prevHash = prev_hash
@@ -50,28 +430,67 @@ class Block:
         self.difficulty_target = difficulty_target
         self.nonce = nonce
         self.transactions = transactions
-        self.MerkleRoot = self.calculate_merkle_root()
-        self.block_hash = self.calculate_hash()
+        self.MerkleRoot = self._current_merkle_tree().root_hex()
         self.signature = None
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        for cache_name in self._INVALIDATES.get(name, ()):
+            self.__dict__[cache_name] = None
+
+    @property
+    def block_hash(self):
+        if self._block_hash is None:
+            self._block_hash = self.calculate_hash()
+        return self._block_hash
+
+    @block_hash.setter
+    def block_hash(self, value: str):
+        # Майнер уже знає геш знайденого nonce - зберігаємо його без повторного обчислення
+        self._block_hash = value
+
+    def _current_merkle_tree(self):
+        digests = [tx.digest for tx in self.transactions]
+        if self.merkle_tree is None or self.merkle_tree.levels[0] != digests:
+            self.merkle_tree = MerkleTree(digests)
+        return self.merkle_tree
+
     def calculate_merkle_root(self):
-        transaction_hashes = [tx.txHash for tx in self.transactions]
-        if not transaction_hashes:
-            return ""
-        while len(transaction_hashes) > 1:
-            temp_hashes = []
-            for i in range(0, len(transaction_hashes), 2):
-                if i + 1 < len(transaction_hashes):
-                    combined_hash = transaction_hashes[i] + transaction_hashes[i + 1]
-                else:
-                    combined_hash = transaction_hashes[i]
-                temp_hashes.append(hashlib.sha256(combined_hash.encode()).hexdigest())
-            transaction_hashes = temp_hashes
-        return transaction_hashes[0]
+        return self._current_merkle_tree().root_hex()
+
+    def add_transaction(self, transaction: Transaction):
+        if self.signature is not None:
+            raise Exception("Block has already been signed.")
+        self.transactions.append(transaction)
+        if self.merkle_tree is not None:
+            self.merkle_tree.append(transaction.digest)
+        self.MerkleRoot = self.merkle_tree.root_hex() if self.merkle_tree is not None else self.calculate_merkle_root()
+
+    def get_merkle_proof(self, tx_index: int):
+        return self._current_merkle_tree().get_proof(tx_index)
+
+    def header_prefix(self):
+        if self._header_prefix is None:
+            # struct мовчки обрізав би довшу версію, і відкинуті символи не входили б у геш блоку
+            version = self.version.encode()
+            if len(version) > MAX_VERSION_SIZE:
+                raise ValueError(f"Block version must encode to at most {MAX_VERSION_SIZE} bytes: {self.version!r}")
+            self._header_prefix = HEADER_PREFIX_STRUCT.pack(
+                version,
+                hex_to_digest(self.prevHash),
+                self.timestamp,
+                self.difficulty_target.to_bytes(32, "big"),
+                hex_to_digest(self.MerkleRoot),
+            )
+        return self._header_prefix
+
+    def header_midstate(self):
+        return hashlib.sha256(self.header_prefix())
 
     def calculate_hash(self):
-        block_string = f"{self.version}{self.prevHash}{self.timestamp}{self.difficulty_target}{self.nonce}{self.MerkleRoot}"
-        return hashlib.sha256(block_string.encode()).hexdigest()
+        header_hash = self.header_midstate()
+        header_hash.update(NONCE_STRUCT.pack(self.nonce))
+        return header_hash.hexdigest()
 
     def sign_block(self, private_key: SigningKey):
         if self.signature is not None:
@@ -84,6 +503,9 @@ class Block:
     def verify_merkle_root(self):
         return self.MerkleRoot == self.calculate_merkle_root()
 
+    def verify_transactions(self, public_keys: list, num_workers: int = None, pool=None):
+        return verify_signatures_batch(list(zip(self.transactions, public_keys)), num_workers, pool)
+
     def to_dict(self):
         return {
             "version": self.version,
@@ -97,53 +519,1041 @@ class Block:
             "signature": base64.b64encode(self.signature).decode() if self.signature else None
         }
 
+    def encode(self):
+        return self._encode([tx.encode() for tx in self.transactions])
+
+    def _encode(self, tx_parts: list):
+        parts = [self.header_prefix(), NONCE_STRUCT.pack(self.nonce), _encode_field(self.signature or b""),
+                 encode_varint(len(tx_parts))]
+        parts.extend(tx_parts)
+        return b"".join(parts)
+
+    def to_bytes(self):
+        # Один раз закодований блок повторно віддається кожному перу та сховищу
+        # (змінена транзакція дає новий об'єкт кодування, і порівняння за тотожністю це помічає)
+        tx_parts = [tx.encode() for tx in self.transactions]
+        if self._wire_bytes is None or len(self._wire_tx_parts) != len(tx_parts) \
+                or any(part is not cached for part, cached in zip(tx_parts, self._wire_tx_parts)):
+            self._wire_bytes = bytes([WIRE_FORMAT_VERSION]) + self._encode(tx_parts)
+            self._wire_tx_parts = tx_parts
+        return self._wire_bytes
+
+    @classmethod
+    def read_from(cls, view: memoryview, offset: int):
+        version, prev_hash, timestamp, difficulty_target, merkle_root = HEADER_PREFIX_STRUCT.unpack_from(view, offset)
+        offset += HEADER_PREFIX_STRUCT.size
+        (nonce,) = NONCE_STRUCT.unpack_from(view, offset)
+        offset += NONCE_STRUCT.size
+        signature, offset = _read_field(view, offset)
+        tx_count, offset = read_varint(view, offset)
+        transactions = []
+        for _ in range(tx_count):
+            tx, offset = Transaction.read_from(view, offset)
+            transactions.append(tx)
+
+        # Нульові 32 байти в заголовку - це "0" генезис-блоку та "" порожнього кореня Меркла
+        block = cls.__new__(cls)
+        block.version = version.rstrip(b"\0").decode()
+        block.prevHash = prev_hash.hex() if any(prev_hash) else "0"
+        block.timestamp = timestamp
+        block.difficulty_target = int.from_bytes(difficulty_target, "big")
+        block.nonce = nonce
+        block.transactions = transactions
+        block.MerkleRoot = merkle_root.hex() if any(merkle_root) else ""
+        block.signature = bytes(signature) or None
+        return block, offset
+
+    @classmethod
+    def from_bytes(cls, data):
+        view = memoryview(data)
+        block, offset = cls.read_from(view, _read_wire_version(view))
+        _check_fully_read(view, offset)
+        return block
+
     def __str__(self):
         return json.dumps(self.to_dict(), indent=4)
 
+class ChainStore:
+    # index.dat - записи фіксованої довжини (геш блоку, зсув, довжина, сумарна робота) у порядку висоти,
+    # blocks.dat - сегмент із тілами блоків; дописується, а хвіст обрізається лише під час реорганізації,
+    # hashes.dat - хеш-таблиця геш -> висота з лінійним пробуванням, відображена в пам'ять: заголовок
+    # (скільки блоків у ній, кількість слотів) і слоти з висотою + 1 (0 - порожній слот)
+    INDEX_RECORD_STRUCT = struct.Struct(">32sQI32s")
+    HASH_HEADER_STRUCT = struct.Struct(">QQ")
+    HASH_SLOT_STRUCT = struct.Struct(">Q")
+    MIN_HASH_SLOTS = 1024
+
+    def __init__(self, directory: str, cache_size: int = 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.segment = open(os.path.join(directory, "blocks.dat"), "ab+")
+        self.index_file = open(os.path.join(directory, "index.dat"), "ab+")
+
+        # Недописаний останній запис індексу (збій під час запису) відкидаємо
+        record_size = self.INDEX_RECORD_STRUCT.size
+        self._count = os.fstat(self.index_file.fileno()).st_size // record_size
+        self.index_file.truncate(self._count * record_size)
+
+        self._index_map = None
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self.blocks_by_hash = _StoredBlocksByHash(self)
+        self._open_hash_index(os.path.join(directory, "hashes.dat"))
+
+    def _open_hash_index(self, path: str):
+        self.hash_file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self._hash_map = None
+        self._hash_slots = 0
+        size = os.fstat(self.hash_file.fileno()).st_size
+        if size >= self.HASH_HEADER_STRUCT.size:
+            self._hash_map = mmap.mmap(self.hash_file.fileno(), 0)
+            indexed, slots = self.HASH_HEADER_STRUCT.unpack_from(self._hash_map, 0)
+            if slots >= self.MIN_HASH_SLOTS and slots & (slots - 1) == 0 and indexed <= self._count \
+                    and size == self.HASH_HEADER_STRUCT.size + slots * self.HASH_SLOT_STRUCT.size:
+                # Таблиця пишеться після індексу, тож після збою їй можуть бракувати лише останні записи
+                self._hash_slots = slots
+                for height in range(indexed, self._count):
+                    self._hash_add(self._index_record(height)[0], height)
+                self._write_hash_header()
+                return
+        # Таблиці немає або вона пошкоджена - будуємо з індексу
+        self._rebuild_hash_index(self.MIN_HASH_SLOTS)
+
+    def _rebuild_hash_index(self, min_slots: int):
+        slots = min_slots
+        while slots < 2 * (self._count + 1):
+            slots *= 2
+        if self._hash_map is not None:
+            self._hash_map.close()
+        self.hash_file.truncate(0)
+        self.hash_file.truncate(self.HASH_HEADER_STRUCT.size + slots * self.HASH_SLOT_STRUCT.size)
+        self._hash_map = mmap.mmap(self.hash_file.fileno(), 0)
+        self._hash_slots = slots
+        for height in range(self._count):
+            self._hash_insert(self._index_record(height)[0], height)
+        self._write_hash_header()
+
+    def _write_hash_header(self):
+        self.HASH_HEADER_STRUCT.pack_into(self._hash_map, 0, self._count, self._hash_slots)
+
+    def _hash_home(self, digest: bytes):
+        # Геші блоків з PoW починаються з нулів, тож слот визначають останні 8 байтів
+        return int.from_bytes(digest[-8:], "big") & (self._hash_slots - 1)
+
+    def _hash_slot_offset(self, slot: int):
+        return self.HASH_HEADER_STRUCT.size + slot * self.HASH_SLOT_STRUCT.size
+
+    def _hash_probe(self, digest: bytes):
+        # (слот, висота) для знайденого гешу або (порожній слот, None); висоту звіряємо з індексом
+        mask = self._hash_slots - 1
+        slot = self._hash_home(digest)
+        while True:
+            (value,) = self.HASH_SLOT_STRUCT.unpack_from(self._hash_map, self._hash_slot_offset(slot))
+            if value == 0:
+                return slot, None
+            height = value - 1
+            if height < self._count and self._index_record(height)[0] == digest:
+                return slot, height
+            slot = (slot + 1) & mask
+
+    def _hash_insert(self, digest: bytes, height: int):
+        slot, _ = self._hash_probe(digest)
+        self.HASH_SLOT_STRUCT.pack_into(self._hash_map, self._hash_slot_offset(slot), height + 1)
+
+    def _hash_add(self, digest: bytes, height: int):
+        if 2 * (height + 1) > self._hash_slots:
+            self._rebuild_hash_index(2 * self._hash_slots)
+        self._hash_insert(digest, height)
+
+    def _hash_remove(self, digest: bytes):
+        # Видалення зі зсувом назад: наступні записи того самого ланцюжка пробування підтягуються у звільнений слот
+        slot, height = self._hash_probe(digest)
+        if height is None:
+            return
+        mask = self._hash_slots - 1
+        empty = slot
+        while True:
+            slot = (slot + 1) & mask
+            (value,) = self.HASH_SLOT_STRUCT.unpack_from(self._hash_map, self._hash_slot_offset(slot))
+            if value == 0:
+                break
+            home = self._hash_home(self._index_record(value - 1)[0])
+            if (slot - home) & mask >= (slot - empty) & mask:
+                self.HASH_SLOT_STRUCT.pack_into(self._hash_map, self._hash_slot_offset(empty), value)
+                empty = slot
+        self.HASH_SLOT_STRUCT.pack_into(self._hash_map, self._hash_slot_offset(empty), 0)
+
+    def _index_record(self, height: int):
+        record_size = self.INDEX_RECORD_STRUCT.size
+        if self._index_map is None or len(self._index_map) < (height + 1) * record_size:
+            if self._index_map is not None:
+                self._index_map.close()
+            self._index_map = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.INDEX_RECORD_STRUCT.unpack_from(self._index_map, height * record_size)
+
+    def _remember(self, height: int, block: Block):
+        self._cache[height] = block
+        self._cache.move_to_end(height)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, height: int):
+        if height < 0:
+            height += self._count
+        if not 0 <= height < self._count:
+            raise IndexError("Block height out of range.")
+        block = self._cache.get(height)
+        if block is None:
+            _, offset, length, _ = self._index_record(height)
+            block = Block.from_bytes(os.pread(self.segment.fileno(), length, offset))
+            self._remember(height, block)
+        return block
+
+    def __iter__(self):
+        for height in range(self._count):
+            yield self[height]
+
+    def read_raw(self, height: int, size: int = None):
+        # Сирі байти блоку без декодування; size обмежує читання, наприклад лише заголовком
+        _, offset, length, _ = self._index_record(height)
+        return os.pread(self.segment.fileno(), length if size is None else min(size, length), offset)
+
+    def iter_raw(self, start: int = 0):
+        # Для потокової перевірки ланцюга
+        for height in range(start, self._count):
+            yield self.read_raw(height)
+
+    def append(self, block: Block, cumulative_work: int = 0):
+        data = block.to_bytes()
+        self.segment.seek(0, os.SEEK_END)
+        offset = self.segment.tell()
+        self.segment.write(data)
+        self.segment.flush()
+        # Індекс пишемо після тіла блоку, тож він ніколи не вказує на неповні дані
+        block_digest = bytes.fromhex(block.block_hash)
+        self.index_file.write(self.INDEX_RECORD_STRUCT.pack(block_digest, offset, len(data),
+                                                            cumulative_work.to_bytes(32, "big")))
+        self.index_file.flush()
+        self._remember(self._count, block)
+        self._count += 1
+        self._hash_add(block_digest, self._count - 1)
+        self._write_hash_header()
+
+    def pop(self):
+        # Відкат вершини: спершу обрізаємо індекс, потім сегмент, тож індекс не вказує на відсутні дані
+        if self._count == 0:
+            raise IndexError("pop from empty chain store")
+        block = self[self._count - 1]
+        block_digest, offset, _, _ = self._index_record(self._count - 1)
+        # Спершу зменшуємо лічильник у заголовку таблиці: після збою відсутній запис буде дописано знову
+        self.HASH_HEADER_STRUCT.pack_into(self._hash_map, 0, self._count - 1, self._hash_slots)
+        self._hash_remove(block_digest)
+        self._count -= 1
+        if self._index_map is not None:
+            # Відображення довше за обрізаний файл - перестворимо його при наступному читанні
+            self._index_map.close()
+            self._index_map = None
+        self.index_file.truncate(self._count * self.INDEX_RECORD_STRUCT.size)
+        self.index_file.flush()
+        self.segment.truncate(offset)
+        self.segment.flush()
+        self._cache.pop(self._count, None)
+        return block
+
+    def block_hash_at(self, height: int):
+        return self._index_record(height)[0].hex()
+
+    def cumulative_work_at(self, height: int):
+        return int.from_bytes(self._index_record(height)[3], "big")
+
+    def height_of(self, block_hash: str):
+        if len(block_hash) != 64:
+            return None
+        return self._hash_probe(bytes.fromhex(block_hash))[1]
+
+    def sync(self):
+        os.fsync(self.segment.fileno())
+        os.fsync(self.index_file.fileno())
+        self._hash_map.flush()
+
+    def close(self):
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        self._hash_map.close()
+        self.segment.close()
+        self.index_file.close()
+        self.hash_file.close()
+
+
+class _StoredBlocksByHash:
+    # Індекс геш -> блок поверх ChainStore з тим самим інтерфейсом, що й dict у Blockchain
+    def __init__(self, store: ChainStore):
+        self.store = store
+
+    def __contains__(self, block_hash: str):
+        return self.store.height_of(block_hash) is not None
+
+    def get(self, block_hash: str):
+        height = self.store.height_of(block_hash)
+        return None if height is None else self.store[height]
+
+
+class AccountState:
+    # Баланси рахунків: відправник (input) сплачує amount, отримувачі (output) ділять його порівну.
+    # Для кожного застосованого блоку зберігаються попередні баланси змінених рахунків (undo-дані),
+    # тож блок можна відкотити без повторного проходу по ланцюгу.
+    def __init__(self, initial_balances: dict = None):
+        self.balances = dict(initial_balances or {})
+        self.applied_transactions = set()
+        self.undo = {}
+
+    def get_balance(self, address: str):
+        return self.balances.get(address, 0.0)
+
+    def check_transaction(self, tx: Transaction, pending_deltas: dict = None, pending_hashes: set = None):
+        # O(1): повтор транзакції та нестача коштів з урахуванням ще не застосованих змін блоку
+        if tx.digest in self.applied_transactions or (pending_hashes and tx.digest in pending_hashes):
+            return False
+        if not tx.output or tx.amount <= 0:
+            return False
+        pending = pending_deltas.get(tx.input, 0.0) if pending_deltas else 0.0
+        return self.get_balance(tx.input) + pending >= tx.amount
+
+    def apply_block(self, block: Block):
+        # Спершу перевіряємо всі транзакції на накладених змінах; стан змінюється лише для валідного блоку
+        deltas = {}
+        hashes = set()
+        for tx in block.transactions:
+            if not self.check_transaction(tx, deltas, hashes):
+                return False
+            deltas[tx.input] = deltas.get(tx.input, 0.0) - tx.amount
+            share = tx.amount / len(tx.output)
+            for receiver in tx.output:
+                deltas[receiver] = deltas.get(receiver, 0.0) + share
+            hashes.add(tx.digest)
+
+        self.undo[block.block_hash] = ({address: self.balances.get(address) for address in deltas}, hashes)
+        for address, delta in deltas.items():
+            self.balances[address] = self.get_balance(address) + delta
+        self.applied_transactions |= hashes
+        return True
+
+    def revert_block(self, block: Block):
+        previous_balances, hashes = self.undo.pop(block.block_hash)
+        for address, balance in previous_balances.items():
+            if balance is None:
+                self.balances.pop(address, None)
+            else:
+                self.balances[address] = balance
+        self.applied_transactions -= hashes
+
+
+def block_work(difficulty_target: int):
+    # Очікувана кількість гешів для блоку з такою ціллю
+    return (1 << 256) // (difficulty_target + 1)
+
+
+class BlockTreeEntry:
+    __slots__ = ("block_hash", "prev_hash", "height", "cumulative_work", "block")
+
+    def __init__(self, block_hash: str, prev_hash: str, height: int, cumulative_work: int, block: Block = None):
+        self.block_hash = block_hash
+        self.prev_hash = prev_hash
+        self.height = height
+        self.cumulative_work = cumulative_work
+        self.block = block
+
+
 class Blockchain:
-    def __init__(self):
-        self.chain = []
-        self.create_genesis_block()
+    def __init__(self, store: ChainStore = None, state: AccountState = None, genesis_block: Block = None):
+        # chain - активний ланцюг (індекс висота -> блок), blocks_by_hash - його індекс геш -> блок;
+        # entries - дерево всіх відомих блоків (усі гілки) з сумарною роботою, best_tip - його найкраща вершина.
+        # Зі сховищем обидва індекси активного ланцюга читаються з диска, а тіла блоків - лише на вимогу
+        self.store = store
+        self.state = state
+        self.entries = {}
+        self.best_tip = None
+        if store is None:
+            self.chain = []
+            self.blocks_by_hash = {}
+        else:
+            self.chain = store
+            self.blocks_by_hash = store.blocks_by_hash
+        if len(self.chain) == 0:
+            self.create_genesis_block(genesis_block)
+        else:
+            # Вершину будуємо прямо із запису індексу - висота і сумарна робота вже в ньому
+            height = len(store) - 1
+            self.best_tip = BlockTreeEntry(store.block_hash_at(height), None, height, store.cumulative_work_at(height))
+            self.entries[self.best_tip.block_hash] = self.best_tip
+            if state is not None:
+                # Стан рахунків не зберігається на диску - відновлюємо його з блоків сховища
+                for block in self.chain:
+                    state.apply_block(block)
 
-    def create_genesis_block(self):
-        genesis_block = Block("1.0", "0", [], 1)
-        self.chain.append(genesis_block)
+    def create_genesis_block(self, genesis_block: Block = None):
+        genesis_block = genesis_block or Block("1.0", "0", [], 1)
+        entry = BlockTreeEntry(genesis_block.block_hash, None, 0, block_work(genesis_block.difficulty_target),
+                               genesis_block)
+        self.entries[entry.block_hash] = entry
+        self._append(genesis_block, entry.cumulative_work)
+        self.best_tip = entry
+
+    def _entry(self, block_hash: str):
+        entry = self.entries.get(block_hash)
+        if entry is None and self.store is not None:
+            # Блоки зі сховища отримують вузол дерева на вимогу: висота й робота є в індексі
+            height = self.store.height_of(block_hash)
+            if height is not None:
+                entry = BlockTreeEntry(block_hash, None, height, self.store.cumulative_work_at(height))
+                self.entries[block_hash] = entry
+        return entry
+
+    def _append(self, block: Block, cumulative_work: int):
+        if self.store is None:
+            self.chain.append(block)
+            self.blocks_by_hash[block.block_hash] = block
+        else:
+            self.chain.append(block, cumulative_work)
+
+    def _connect(self, entry: BlockTreeEntry):
+        if self.state is not None and not self.state.apply_block(entry.block):
+            return False
+        self._append(entry.block, entry.cumulative_work)
+        return True
+
+    def _disconnect(self):
+        if self.store is None:
+            block = self.chain.pop()
+            del self.blocks_by_hash[block.block_hash]
+        else:
+            # Відкочений блок зникає зі сховища, тож у дереві він лишається як бічна гілка разом із тілом
+            height = len(self.store) - 1
+            cumulative_work = self.store.cumulative_work_at(height)
+            block = self.store.pop()
+            self.entries[block.block_hash] = BlockTreeEntry(block.block_hash, block.prevHash, height,
+                                                            cumulative_work, block)
+        if self.state is not None:
+            self.state.revert_block(block)
+        return block
+
+    def _is_active(self, entry: BlockTreeEntry):
+        if entry.height >= len(self.chain):
+            return False
+        if self.store is not None:
+            # Геш - із запису індексу, без читання й декодування тіла блоку
+            return self.store.block_hash_at(entry.height) == entry.block_hash
+        return self.chain[entry.height].block_hash == entry.block_hash
 
     def add_block(self, new_block: Block):
-        if any(block.block_hash == new_block.block_hash for block in self.chain):
+        if new_block.block_hash in self.entries or new_block.block_hash in self.blocks_by_hash:
             print("Блок уже доданий до ланцюга.")
             return False
-        self.chain.append(new_block)
+        parent = self._entry(new_block.prevHash)
+        if parent is None:
+            print("Попередній блок невідомий.")
+            return False
+
+        entry = BlockTreeEntry(new_block.block_hash, new_block.prevHash, parent.height + 1,
+                               parent.cumulative_work + block_work(new_block.difficulty_target), new_block)
+        if parent is self.best_tip:
+            if not self._connect(entry):
+                print("Блок містить повторну транзакцію або витрату понад баланс.")
+                return False
+            self.entries[entry.block_hash] = entry
+            self.best_tip = entry
+            return True
+
+        # Бічна гілка: зберігаємо в дереві, а якщо вона важча за активну - переходимо на неї
+        self.entries[entry.block_hash] = entry
+        if entry.cumulative_work > self.best_tip.cumulative_work:
+            return self._reorganize(entry)
+        return True
+
+    def _reorganize(self, new_tip: BlockTreeEntry):
+        # Шукаємо точку розгалуження; змінюється лише суфікс активного ланцюга після неї
+        branch = []
+        entry = new_tip
+        while not self._is_active(entry):
+            branch.append(entry)
+            entry = self.entries[entry.prev_hash]
+        fork_height = entry.height
+
+        disconnected = []
+        while len(self.chain) - 1 > fork_height:
+            disconnected.append(self._disconnect())
+
+        branch.reverse()
+        for connected, entry in enumerate(branch):
+            if not self._connect(entry):
+                # Невалідний блок: повертаємо попередню гілку і забуваємо його разом з нащадками на цій гілці
+                for _ in range(connected):
+                    self._disconnect()
+                for block in reversed(disconnected):
+                    self._connect(self.entries[block.block_hash])
+                for invalid in branch[connected:]:
+                    del self.entries[invalid.block_hash]
+                print("Гілка містить невалідний блок - реорганізацію скасовано.")
+                return False
+
+        self.best_tip = new_tip
+        print(f"Реорганізація: відкочено {len(disconnected)} блоків, підключено {len(branch)}.")
         return True
 
+    def remove_latest_block(self):
+        if len(self.chain) == 1:
+            raise Exception("Genesis block cannot be removed.")
+        block = self._disconnect()
+        del self.entries[block.block_hash]
+        self.best_tip = self._entry(block.prevHash)
+        return block
+
     def get_latest_block(self):
         return self.chain[-1]
 
+    def get_block(self, block_hash: str):
+        entry = self.entries.get(block_hash)
+        if entry is not None and entry.block is not None:
+            return entry.block
+        return self.blocks_by_hash.get(block_hash)
+
+    def get_block_at(self, height: int):
+        if 0 <= height < len(self.chain):
+            return self.chain[height]
+        return None
+
     def __str__(self):
         return "\n".join(str(block) for block in self.chain)
 
+class Mempool:
+    # Скільки транзакцій, що не влазять у блок, пропускаємо підряд, перш ніж закрити шаблон
+    MAX_TEMPLATE_SKIPS = 50
+
+    def __init__(self, max_transactions: int = 1000000, expiry_seconds: float = 3600.0):
+        self.max_transactions = max_transactions
+        self.expiry_seconds = expiry_seconds
+        # entries - індекс геш -> запис; heap - ті самі записи, впорядковані за пріоритетом;
+        # by_age - записи в порядку надходження для видалення застарілих
+        self.entries = {}
+        self.heap = []
+        self.by_age = deque()
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tx_hash: str):
+        return hex_to_digest(tx_hash) in self.entries
+
+    def add(self, tx: Transaction, fee: float = 0.0):
+        self.expire()
+        if tx.digest in self.entries or len(self.entries) >= self.max_transactions:
+            return False
+        size = len(tx.encode())
+        # Запис: [-пріоритет (комісія за байт), порядковий номер, транзакція, розмір, час додавання];
+        # видалений запис лишається в купі з транзакцією None і пропускається під час вибірки
+        entry = [-fee / size, self._sequence, tx, size, time.time()]
+        self._sequence += 1
+        self.entries[tx.digest] = entry
+        heapq.heappush(self.heap, entry)
+        self.by_age.append(entry)
+        return True
+
+    def get(self, tx_hash: str):
+        entry = self.entries.get(hex_to_digest(tx_hash))
+        return None if entry is None else entry[2]
+
+    def get_fee(self, tx_hash: str):
+        entry = self.entries.get(hex_to_digest(tx_hash))
+        return None if entry is None else -entry[0] * entry[3]
+
+    def remove(self, tx_hash: str):
+        entry = self.entries.pop(hex_to_digest(tx_hash), None)
+        if entry is None:
+            return False
+        entry[2] = None
+        self._compact()
+        return True
+
+    def remove_transactions(self, transactions: list):
+        for tx in transactions:
+            entry = self.entries.pop(tx.digest, None)
+            if entry is not None:
+                entry[2] = None
+        self._compact()
+
+    def expire(self, now: float = None):
+        now = time.time() if now is None else now
+        expired = 0
+        while self.by_age and (self.by_age[0][2] is None or now - self.by_age[0][4] > self.expiry_seconds):
+            entry = self.by_age.popleft()
+            if entry[2] is not None:
+                del self.entries[entry[2].digest]
+                entry[2] = None
+                expired += 1
+        self._compact()
+        return expired
+
+    def _compact(self):
+        # Перебудовуємо купу, коли видалені записи становлять більшість
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [entry for entry in self.heap if entry[2] is not None]
+            heapq.heapify(self.heap)
+
+    def get_block_template(self, max_block_bytes: int = 1000000):
+        # Дістаємо з купи лише k найпріоритетніших записів і повертаємо їх назад - O(k log n)
+        self.expire()
+        selected = []
+        popped = []
+        remaining = max_block_bytes
+        skips = 0
+        while self.heap and skips < self.MAX_TEMPLATE_SKIPS:
+            entry = heapq.heappop(self.heap)
+            if entry[2] is None:
+                continue
+            popped.append(entry)
+            if entry[3] <= remaining:
+                selected.append(entry[2])
+                remaining -= entry[3]
+                skips = 0
+            else:
+                skips += 1
+        for entry in popped:
+            heapq.heappush(self.heap, entry)
+        return selected
+
+
+def _check_block_body(data: bytes):
+    block = Block.from_bytes(data)
+    if not all(tx.verify_hash() for tx in block.transactions):
+        return "tx_hash"
+    if not block.verify_merkle_root():
+        return "merkle"
+    return None
+
+
+_signature_worker_keys = {}
+
+
+def _init_signature_worker(public_keys: dict):
+    global _signature_worker_keys
+    _signature_worker_keys = public_keys
+
+
+def _check_block_signatures(data: bytes):
+    for tx in Block.from_bytes(data).transactions:
+        key_bytes = _signature_worker_keys.get(tx.input)
+        if key_bytes is None or not _verify_signature_job((tx.txHash.encode(), tx.signature, key_bytes)):
+            return "signature"
+    return None
+
+
+def validate_chain_stream(blocks, public_keys: dict = None, prev_hash: str = None, merkle_workers: int = None,
+                          signature_workers: int = None, max_in_flight: int = 64):
+    # Потокова перевірка ланцюга. blocks - будь-який ітератор блоків (Block або сирі байти to_bytes,
+    # наприклад ChainStore.iter_raw()). Зв'язність prevHash, геш заголовка і PoW перевіряються по черзі
+    # в цьому процесі; корінь Меркла та підписи транзакцій - паралельно, кожен етап у своєму пулі процесів.
+    # У роботі одночасно не більше max_in_flight блоків, тож пам'ять обмежена незалежно від довжини ланцюга.
+    # public_keys - адреса відправника -> VerifyingKey; без них підписи не перевіряються.
+    # Повертає (висота, геш блоку, список проблем) у порядку висоти.
+    expected_prev = hex_to_digest(prev_hash) if prev_hash is not None else None
+    signature_keys = {address: key.to_string() for address, key in (public_keys or {}).items()}
+
+    with multiprocessing.Pool(merkle_workers) as merkle_pool, \
+            (multiprocessing.Pool(signature_workers, _init_signature_worker, (signature_keys,))
+             if public_keys else nullcontext()) as signature_pool:
+        pending = deque()
+        for height, item in enumerate(blocks):
+            data = bytes(item) if not isinstance(item, Block) else item.to_bytes()
+            view = memoryview(data)
+            _read_wire_version(view)
+            _, block_prev, _, target, _ = HEADER_PREFIX_STRUCT.unpack_from(view, 1)
+            digest = hashlib.sha256(view[1:1 + HEADER_SIZE]).digest()
+
+            problems = []
+            if isinstance(item, Block) and item.block_hash != digest.hex():
+                problems.append("header_hash")
+            # Перший блок потоку без prev_hash вважається генезис-блоком: зв'язність і PoW не перевіряються
+            if expected_prev is not None:
+                if block_prev != expected_prev:
+                    problems.append("prev_hash")
+                if int.from_bytes(digest, "big") >= int.from_bytes(target, "big"):
+                    problems.append("pow")
+            expected_prev = digest
+
+            merkle_result = merkle_pool.apply_async(_check_block_body, (data,))
+            signature_result = signature_pool.apply_async(_check_block_signatures, (data,)) if public_keys else None
+            pending.append((height, digest.hex(), problems, merkle_result, signature_result))
+            if len(pending) >= max_in_flight:
+                yield _collect_validation(pending.popleft())
+
+        while pending:
+            yield _collect_validation(pending.popleft())
+
+
+def _collect_validation(pending_block):
+    height, block_hash, problems, merkle_result, signature_result = pending_block
+    for result in (merkle_result, signature_result):
+        problem = result.get() if result is not None else None
+        if problem is not None:
+            problems.append(problem)
+    return height, block_hash, problems
+
+
+# Синхронізація нової ноди: спочатку заголовки (дешева перевірка зв'язності та PoW), потім тіла блоків пакетами.
+# Запит - байт типу і два varint (початкова висота, кількість); по сокету кожне повідомлення має префікс довжини
+MSG_GET_STATUS, MSG_GET_HEADERS, MSG_GET_BLOCKS = range(3)
+FRAME_STRUCT = struct.Struct(">I")
+# Скільки запитів відправляється одним пакетом без очікування відповідей
+SYNC_PIPELINE_DEPTH = 64
+
+
+def encode_sync_request(message_type: int, start: int = 0, count: int = 0):
+    return bytes([message_type]) + encode_varint(start) + encode_varint(count)
+
+
+class SyncServer:
+    # Відповідає на запити синхронізації з активного ланцюга; зі сховищем блоки віддаються сирими байтами з диска
+    def __init__(self, blockchain: Blockchain):
+        self.blockchain = blockchain
+
+    def _raw_header(self, height: int):
+        if self.blockchain.store is not None:
+            return self.blockchain.store.read_raw(height, 1 + HEADER_SIZE)[1:]
+        block = self.blockchain.chain[height]
+        return block.header_prefix() + NONCE_STRUCT.pack(block.nonce)
+
+    def _raw_block(self, height: int):
+        if self.blockchain.store is not None:
+            return self.blockchain.store.read_raw(height)
+        return self.blockchain.chain[height].to_bytes()
+
+    def handle(self, request: bytes):
+        view = memoryview(request)
+        message_type = view[0]
+        start, offset = read_varint(view, 1)
+        count, _ = read_varint(view, offset)
+        tip = self.blockchain.best_tip
+        if message_type == MSG_GET_STATUS:
+            return encode_varint(tip.height) + hex_to_digest(tip.block_hash)
+
+        heights = range(start, min(start + count, tip.height + 1))
+        if message_type == MSG_GET_HEADERS:
+            return encode_varint(len(heights)) + b"".join(self._raw_header(height) for height in heights)
+        if message_type == MSG_GET_BLOCKS:
+            return encode_varint(len(heights)) + b"".join(_encode_field(self._raw_block(height)) for height in heights)
+        raise ValueError(f"Unknown sync message type: {message_type}")
+
+
+class InProcessTransport:
+    # Замінник сокета в межах одного процесу: ті самі байтові запити й відповіді, але без мережі
+    def __init__(self, server: SyncServer):
+        self.server = server
+        self.round_trips = 0
+
+    def request_many(self, requests: list):
+        self.round_trips += 1
+        return [self.server.handle(request) for request in requests]
+
+    def request(self, request: bytes):
+        return self.request_many([request])[0]
+
+    def close(self):
+        pass
+
+
+def _send_frames(sock: socket.socket, payloads: list):
+    sock.sendall(b"".join(FRAME_STRUCT.pack(len(payload)) + payload for payload in payloads))
+
+
+def _read_frame(reader):
+    header = reader.read(FRAME_STRUCT.size)
+    if len(header) < FRAME_STRUCT.size:
+        return None
+    (length,) = FRAME_STRUCT.unpack(header)
+    return reader.read(length)
+
+
+class SocketTransport:
+    # Постійне TCP-з'єднання; кілька запитів відправляються одним записом, відповіді приходять у тому ж порядку
+    def __init__(self, address: tuple):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        self.round_trips = 0
+
+    def request_many(self, requests: list):
+        self.round_trips += 1
+        _send_frames(self.sock, requests)
+        responses = [_read_frame(self.reader) for _ in requests]
+        if any(response is None for response in responses):
+            raise ConnectionError("Sync peer closed the connection.")
+        return responses
+
+    def request(self, request: bytes):
+        return self.request_many([request])[0]
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class _SyncRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            request = _read_frame(self.rfile)
+            if request is None:
+                return
+            _send_frames(self.connection, [self.server.sync_server.handle(request)])
+
+
+def serve_sync(blockchain: Blockchain, host: str = "127.0.0.1", port: int = 0):
+    # Сервер синхронізації у фоновому потоці; адреса - server.server_address, зупинка - shutdown() і server_close()
+    server = socketserver.ThreadingTCPServer((host, port), _SyncRequestHandler)
+    server.daemon_threads = True
+    server.sync_server = SyncServer(blockchain)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Як часто воркер майнингу перевіряє, чи не знайшов nonce інший процес
+MINING_STOP_CHECK_INTERVAL = 10000
+
+
+def _mine_nonce_range(worker_id, num_workers, header_prefix, difficulty_target, stop_event, result_queue):
+    # Воркер перебирає nonce = worker_id, worker_id + num_workers, ... поки хтось не знайде блок
+    midstate = hashlib.sha256(header_prefix)
+    pack_nonce = NONCE_STRUCT.pack
+    nonce = worker_id
+    hashes = 0
+    found = None
+    start_time = time.perf_counter()
+    while not stop_event.is_set():
+        for _ in range(MINING_STOP_CHECK_INTERVAL):
+            header_hash = midstate.copy()
+            header_hash.update(pack_nonce(nonce))
+            digest = header_hash.digest()
+            hashes += 1
+            if int.from_bytes(digest, "big") < difficulty_target:
+                found = (nonce, digest.hex())
+                break
+            nonce += num_workers
+        if found is not None:
+            stop_event.set()
+            break
+    elapsed = time.perf_counter() - start_time
+    result_queue.put({
+        "worker_id": worker_id,
+        "found": found,
+        "hashes": hashes,
+        "elapsed": elapsed,
+        "hashes_per_sec": hashes / elapsed if elapsed > 0 else 0.0,
+    })
+
+
 class Node:
     def __init__(self, blockchain: Blockchain):
         self.blockchain = blockchain
+        self.mempool = Mempool()
+        self.last_mining_stats = []
+
+    def submit_transaction(self, tx: Transaction, fee: float = 0.0):
+        return self.mempool.add(tx, fee)
+
+    def mine_block_from_mempool(self, difficulty_target: int, max_block_bytes: int = 1000000):
+        return self.mine_block(self.mempool.get_block_template(max_block_bytes), difficulty_target)
 
     def mine_block(self, transactions: list, difficulty_target: int):
         prev_block = self.blockchain.get_latest_block()
         new_block = Block("1.0", prev_block.block_hash, transactions, difficulty_target)
         print(f"Майнинг нового блоку з хешем попереднього блоку: {prev_block.block_hash}")
 
-        while int(new_block.block_hash, 16) >= difficulty_target:
-            new_block.nonce += 1
-            new_block.block_hash = new_block.calculate_hash()
+        # Префікс заголовка гешується один раз, у циклі змінюється лише nonce
+        midstate = new_block.header_midstate()
+        pack_nonce = NONCE_STRUCT.pack
+        nonce = new_block.nonce
+        while True:
+            header_hash = midstate.copy()
+            header_hash.update(pack_nonce(nonce))
+            digest = header_hash.digest()
+            if int.from_bytes(digest, "big") < difficulty_target:
+                break
+            nonce += 1
+        if METRICS.enabled:
+            METRICS.count("mining.iterations", nonce - new_block.nonce + 1)
+        new_block.nonce = nonce
+        new_block.block_hash = digest.hex()
 
         print(f"Блок знайдено! Nonce: {new_block.nonce}, Хеш блоку: {new_block.block_hash}")
         return new_block
 
+    def mine_block_parallel(self, transactions: list, difficulty_target: int, num_workers: int = None):
+        prev_block = self.blockchain.get_latest_block()
+        new_block = Block("1.0", prev_block.block_hash, transactions, difficulty_target)
+        num_workers = num_workers or multiprocessing.cpu_count()
+        print(f"Паралельний майнинг ({num_workers} процесів) з хешем попереднього блоку: {prev_block.block_hash}")
+
+        # Частина заголовка до nonce не змінюється під час пошуку
+        header_prefix = new_block.header_prefix()
+
+        stop_event = multiprocessing.Event()
+        result_queue = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_mine_nonce_range,
+                args=(i, num_workers, header_prefix, difficulty_target, stop_event, result_queue),
+            )
+            for i in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        stats = self._collect_mining_stats(workers, stop_event, result_queue)
+        for worker in workers:
+            worker.join()
+        if METRICS.enabled:
+            METRICS.count("mining.iterations", sum(stat["hashes"] for stat in stats))
+
+        # Якщо кілька воркерів знайшли розв'язок одночасно, беремо найменший nonce
+        winners = sorted(stat["found"] for stat in stats if stat["found"] is not None)
+        new_block.nonce, new_block.block_hash = winners[0]
+        self.last_mining_stats = sorted(stats, key=lambda stat: stat["worker_id"])
+
+        for stat in self.last_mining_stats:
+            print(f"Воркер {stat['worker_id']}: {stat['hashes']} хешів, {stat['hashes_per_sec']:.0f} хеш/с")
+        print(f"Блок знайдено! Nonce: {new_block.nonce}, Хеш блоку: {new_block.block_hash}")
+        return new_block
+
+    @staticmethod
+    def _collect_mining_stats(workers: list, stop_event, result_queue, poll_interval: float = 0.5):
+        # Воркер, що впав (OOM, сигнал, помилка pickle), звіту не надішле - без перевірки get() чекав би вічно
+        stats = {}
+        while len(stats) < len(workers):
+            try:
+                stat = result_queue.get(timeout=poll_interval)
+                stats[stat["worker_id"]] = stat
+                continue
+            except queue.Empty:
+                pass
+            if all(worker.exitcode is None for i, worker in enumerate(workers) if i not in stats):
+                continue
+            # Звіт воркера потрапляє в канал до завершення процесу - забираємо те, що ще не прочитано
+            try:
+                while True:
+                    stat = result_queue.get(timeout=poll_interval)
+                    stats[stat["worker_id"]] = stat
+            except queue.Empty:
+                pass
+            crashed = [(i, worker.exitcode) for i, worker in enumerate(workers)
+                       if i not in stats and worker.exitcode is not None]
+            if crashed:
+                stop_event.set()
+                for worker in workers:
+                    worker.join(timeout=5)
+                    if worker.is_alive():
+                        worker.terminate()
+                raise Exception(f"Mining worker {crashed[0][0]} exited with code {crashed[0][1]} without a result.")
+        return list(stats.values())
+
+    def accept_block(self, block: Block):
+        if not self.blockchain.add_block(block):
+            return False
+        self.mempool.remove_transactions(block.transactions)
+        return True
+
     def receive_block(self, block: Block):
-        if self.blockchain.add_block(block):
+        if self.accept_block(block):
             print(f"Блок успішно доданий до локального блокчейну ноди.")
         else:
             print(f"Блок відхилено.")
 
+    def sync_from_peer(self, connect, header_batch: int = 2000, block_batch: int = 64, parallel_requests: int = 4):
+        # connect() повертає нове з'єднання з пером (InProcessTransport або SocketTransport);
+        # тіла блоків завантажуються паралельно через parallel_requests з'єднань
+        transports = [connect() for _ in range(parallel_requests)]
+        try:
+            headers = self._download_headers(transports[0], header_batch)
+            if headers is None:
+                return False
+            return self._download_blocks(transports, headers, block_batch)
+        finally:
+            for transport in transports:
+                transport.close()
+
+    def _download_headers(self, transport, header_batch: int):
+        tip = self.blockchain.best_tip
+        status = transport.request(encode_sync_request(MSG_GET_STATUS))
+        peer_height, _ = read_varint(memoryview(status), 0)
+        if peer_height <= tip.height:
+            print("Ланцюг пера не довший за локальний.")
+            return []
+
+        # Висота пера відома наперед, тож запити заголовків ідуть пакетами без очікування кожної відповіді
+        requests = [encode_sync_request(MSG_GET_HEADERS, start, header_batch)
+                    for start in range(tip.height + 1, peer_height + 1, header_batch)]
+        headers = []
+        prev_digest = hex_to_digest(tip.block_hash)
+        for i in range(0, len(requests), SYNC_PIPELINE_DEPTH):
+            for response in transport.request_many(requests[i:i + SYNC_PIPELINE_DEPTH]):
+                view = memoryview(response)
+                count, offset = read_varint(view, 0)
+                for _ in range(count):
+                    header = view[offset:offset + HEADER_SIZE]
+                    offset += HEADER_SIZE
+                    _, block_prev, _, target, _ = HEADER_PREFIX_STRUCT.unpack_from(header)
+                    digest = hashlib.sha256(header).digest()
+                    if block_prev != prev_digest or int.from_bytes(digest, "big") >= int.from_bytes(target, "big"):
+                        print(f"Невалідний заголовок на висоті {tip.height + len(headers) + 1} - синхронізацію зупинено.")
+                        return None
+                    headers.append(digest)
+                    prev_digest = digest
+        return headers
+
+    def _download_blocks(self, transports: list, headers: list, block_batch: int):
+        first_height = self.blockchain.best_tip.height + 1
+        free_transports = queue.Queue()
+        for transport in transports:
+            free_transports.put(transport)
+
+        def fetch(start):
+            transport = free_transports.get()
+            try:
+                return transport.request(encode_sync_request(MSG_GET_BLOCKS, start, block_batch))
+            finally:
+                free_transports.put(transport)
+
+        # Пакети завантажуються наперед (не більше двох на з'єднання), а до ланцюга додаються строго по черзі
+        starts = iter(range(first_height, first_height + len(headers), block_batch))
+        height = first_height
+        with ThreadPoolExecutor(len(transports)) as executor:
+            pending = deque(executor.submit(fetch, start) for start in itertools.islice(starts, 2 * len(transports)))
+            while pending:
+                response = pending.popleft().result()
+                next_start = next(starts, None)
+                if next_start is not None:
+                    pending.append(executor.submit(fetch, next_start))
+
+                view = memoryview(response)
+                count, offset = read_varint(view, 0)
+                for _ in range(count):
+                    data, offset = _read_field(view, offset)
+                    block = Block.from_bytes(data)
+                    if block.block_hash != headers[height - first_height].hex() or not block.verify_merkle_root():
+                        print(f"Тіло блоку на висоті {height} не відповідає заголовку - синхронізацію зупинено.")
+                        return False
+                    if not self.blockchain.add_block(block):
+                        return False
+                    self.mempool.remove_transactions(block.transactions)
+                    height += 1
+
+        if height != first_height + len(headers):
+            print("Пер віддав не всі блоки - синхронізацію зупинено.")
+            return False
+        return True
+
     @staticmethod
     def generate_random_transactions(num_transactions: int):
         transactions = []
@@ -154,6 +1564,692 @@ class Node:
             transactions.append(Transaction(sender, receivers, amount))
         return transactions
 
+# Gossip на основі інвентаря: ноди оголошують геші блоків і транзакцій (inv), а повні дані запитують (getdata)
+# лише ті, кому їх бракує, і лише в одного пера. Елемент інвентаря - байт типу і 32 байти гешу
+INV_BLOCK, INV_TRANSACTION = 1, 2
+INV_ITEM_SIZE = 1 + 32
+# Скільки запасних перів запам'ятовувати для елемента, запит якого ще в дорозі
+MAX_ITEM_ANNOUNCERS = 8
+TX_FEE_STRUCT = struct.Struct(">d")
+
+
+def inventory_item(inv_type: int, digest: bytes):
+    return bytes([inv_type]) + digest
+
+
+class GossipNetwork:
+    """Мережа gossip у межах процесу: граф перів і черга повідомлень, що доставляються по черзі."""
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.queue = deque()
+        self.message_counts = {}
+        self.message_bytes = {}
+
+    def connect_random(self, nodes: list, degree: int):
+        # Кожна нода з'єднується з degree випадковими іншими; з'єднання двобічні
+        for node in nodes:
+            others = [other for other in nodes if other is not node and other not in node.peers]
+            for peer in self.rng.sample(others, min(degree, len(others))):
+                node.peers.append(peer)
+                peer.peers.append(node)
+
+    def send(self, sender, recipient, kind: str, payload, size: int):
+        self.message_counts[kind] = self.message_counts.get(kind, 0) + 1
+        self.message_bytes[kind] = self.message_bytes.get(kind, 0) + size
+        self.queue.append((recipient, sender, kind, payload))
+
+    def run(self):
+        while self.queue:
+            recipient, sender, kind, payload = self.queue.popleft()
+            recipient.handle(sender, kind, payload)
+
+
+class GossipNode:
+    """Обгортка над Node для gossip: оголошення, запит відсутнього та пересилання далі.
+
+    seen - обмежена множина вже отриманих елементів інвентаря (найстаріші витісняються),
+    requested - елементи в дорозі: у кого й коли запитано, щоб не запитувати їх одночасно в інших.
+    Якщо пер не відповів за request_timeout (expire_requests) або від'єднався (peer_disconnected),
+    елемент запитується в іншого пера, що його оголошував. requested і orphans мають верхню межу.
+    fanout - скільком випадковим перам пересилати оголошення; None - усім.
+    """
+
+    def __init__(self, node: Node, network: GossipNetwork, fanout: int = None, seen_capacity: int = 100000,
+                 request_timeout: float = 5.0, max_requested: int = 50000, max_orphans: int = 1000):
+        self.node = node
+        self.network = network
+        self.fanout = fanout
+        self.seen_capacity = seen_capacity
+        self.request_timeout = request_timeout
+        self.max_requested = max_requested
+        self.max_orphans = max_orphans
+        self.peers = []
+        self.seen = OrderedDict()
+        # елемент -> (пер, час запиту) у порядку запитів; елемент -> запасні пери, що його оголосили
+        self.requested = OrderedDict()
+        self.announcers = {}
+        # Блоки, що прийшли раніше за свого батька: геш -> блок у порядку надходження, геш батька -> геші дітей
+        self.orphans = OrderedDict()
+        self.orphans_by_parent = {}
+
+    def _remember(self, item: bytes):
+        self.seen[item] = None
+        self.seen.move_to_end(item)
+        if len(self.seen) > self.seen_capacity:
+            self.seen.popitem(last=False)
+
+    def _has(self, item: bytes):
+        if item in self.seen:
+            return True
+        item_hash = item[1:].hex()
+        if item[0] == INV_BLOCK:
+            return self.node.blockchain.get_block(item_hash) is not None
+        return item_hash in self.node.mempool
+
+    def _announce(self, item: bytes, exclude=None):
+        peers = [peer for peer in self.peers if peer is not exclude]
+        if self.fanout is not None and self.fanout < len(peers):
+            peers = self.network.rng.sample(peers, self.fanout)
+        for peer in peers:
+            self.network.send(self, peer, "inv", [item], 1 + INV_ITEM_SIZE)
+
+    def publish_block(self, block: Block):
+        if not self.node.accept_block(block):
+            return False
+        item = inventory_item(INV_BLOCK, bytes.fromhex(block.block_hash))
+        self._remember(item)
+        self._announce(item)
+        return True
+
+    def publish_transaction(self, tx: Transaction, fee: float = 0.0):
+        if not self.node.submit_transaction(tx, fee):
+            return False
+        item = inventory_item(INV_TRANSACTION, tx.digest)
+        self._remember(item)
+        self._announce(item)
+        return True
+
+    def handle(self, sender, kind: str, payload):
+        if kind == "inv":
+            self.on_inv(sender, payload)
+        elif kind == "getdata":
+            self.on_getdata(sender, payload)
+        elif kind == "block":
+            self.on_block(sender, payload)
+        elif kind == "tx":
+            self.on_transaction(sender, *payload)
+
+    def _request(self, peer, items: list):
+        now = time.monotonic()
+        for item in items:
+            self.requested[item] = (peer, now)
+            self.requested.move_to_end(item)
+            if len(self.requested) > self.max_requested:
+                stale, _ = self.requested.popitem(last=False)
+                self.announcers.pop(stale, None)
+        self.network.send(self, peer, "getdata", items, 1 + len(items) * INV_ITEM_SIZE)
+
+    def _received(self, item: bytes):
+        self.requested.pop(item, None)
+        self.announcers.pop(item, None)
+        self._remember(item)
+
+    def _rerequest(self, items: list):
+        # Запитуємо елементи в наступного пера, що їх оголошував; без запасного джерела елемент забуваємо,
+        # і його знову запитають після нового оголошення
+        by_peer = {}
+        for item in items:
+            self.requested.pop(item, None)
+            alternatives = [peer for peer in self.announcers.get(item, []) if peer in self.peers]
+            if not alternatives:
+                self.announcers.pop(item, None)
+                continue
+            self.announcers[item] = alternatives[1:]
+            by_peer.setdefault(alternatives[0], []).append(item)
+        for peer, peer_items in by_peer.items():
+            self._request(peer, peer_items)
+
+    def expire_requests(self):
+        # Викликається періодично; requested упорядкований за часом запиту, тож прострочені - на початку
+        deadline = time.monotonic() - self.request_timeout
+        expired = []
+        for item, (_, requested_at) in self.requested.items():
+            if requested_at > deadline:
+                break
+            expired.append(item)
+        self._rerequest(expired)
+        return len(expired)
+
+    def peer_disconnected(self, peer):
+        if peer in self.peers:
+            self.peers.remove(peer)
+        self._rerequest([item for item, (asked, _) in self.requested.items() if asked is peer])
+
+    def on_inv(self, sender, items: list):
+        now = time.monotonic()
+        wanted = []
+        for item in items:
+            if self._has(item):
+                continue
+            request = self.requested.get(item)
+            if request is not None and now - request[1] < self.request_timeout:
+                # Запит уже в дорозі - пер стане запасним джерелом, якщо перший не відповість
+                alternatives = self.announcers.setdefault(item, [])
+                if sender is not request[0] and sender not in alternatives and len(alternatives) < MAX_ITEM_ANNOUNCERS:
+                    alternatives.append(sender)
+                continue
+            wanted.append(item)
+        if wanted:
+            self._request(sender, wanted)
+
+    def on_getdata(self, sender, items: list):
+        for item in items:
+            item_hash = item[1:].hex()
+            if item[0] == INV_BLOCK:
+                block = self.node.blockchain.get_block(item_hash)
+                if block is not None:
+                    data = block.to_bytes()
+                    self.network.send(self, sender, "block", data, len(data))
+            else:
+                tx = self.node.mempool.get(item_hash)
+                if tx is not None:
+                    data = tx.to_bytes()
+                    self.network.send(self, sender, "tx", (data, self.node.mempool.get_fee(item_hash)),
+                                      len(data) + TX_FEE_STRUCT.size)
+
+    def on_block(self, sender, data: bytes):
+        block = Block.from_bytes(data)
+        item = inventory_item(INV_BLOCK, bytes.fromhex(block.block_hash))
+        self._received(item)
+        if self.node.blockchain.get_block(block.prevHash) is None:
+            # Батька запитуємо в того ж пера - він його вже прийняв, інакше не оголосив би блок
+            self._add_orphan(block)
+            self.on_inv(sender, [inventory_item(INV_BLOCK, hex_to_digest(block.prevHash))])
+            return
+        self._connect_block(block, item, sender)
+
+    def _add_orphan(self, block: Block):
+        if block.block_hash in self.orphans:
+            return
+        self.orphans[block.block_hash] = block
+        self.orphans_by_parent.setdefault(block.prevHash, []).append(block.block_hash)
+        if len(self.orphans) > self.max_orphans:
+            # Витіснений блок забуваємо повністю, щоб його можна було отримати знову після нового оголошення
+            evicted_hash, evicted = self.orphans.popitem(last=False)
+            siblings = self.orphans_by_parent[evicted.prevHash]
+            siblings.remove(evicted_hash)
+            if not siblings:
+                del self.orphans_by_parent[evicted.prevHash]
+            self.seen.pop(inventory_item(INV_BLOCK, bytes.fromhex(evicted_hash)), None)
+
+    def _connect_block(self, block: Block, item: bytes, sender):
+        # Далі пересилаються лише блоки з правильним PoW і коренем Меркла, які нода прийняла
+        if int(block.block_hash, 16) >= block.difficulty_target or not block.verify_merkle_root():
+            return
+        if not self.node.accept_block(block):
+            return
+        self._announce(item, exclude=sender)
+        for child_hash in self.orphans_by_parent.pop(block.block_hash, []):
+            child = self.orphans.pop(child_hash)
+            self._connect_block(child, inventory_item(INV_BLOCK, bytes.fromhex(child.block_hash)), None)
+
+    def on_transaction(self, sender, data: bytes, fee: float):
+        tx = Transaction.from_bytes(data)
+        item = inventory_item(INV_TRANSACTION, tx.digest)
+        self._received(item)
+        if tx.verify_hash() and self.node.submit_transaction(tx, fee):
+            self._announce(item, exclude=sender)
+
+
+# Мережева нода на asyncio: ті самі повідомлення gossip, але через TCP або Unix-сокети. Кадр - довжина (4 байти),
+# байт типу повідомлення і тіло: inv/getdata - varint кількості та елементи інвентаря, block - байти блоку,
+# tx - комісія (8 байт) і байти транзакції, hello - ідентифікатор ноди (адреса, яку вона слухає)
+NETWORK_MESSAGE_CODES = {"inv": 1, "getdata": 2, "block": 3, "tx": 4, "hello": 5}
+NETWORK_MESSAGE_KINDS = {code: kind for kind, code in NETWORK_MESSAGE_CODES.items()}
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+
+
+def encode_gossip_message(kind: str, payload):
+    if kind in ("inv", "getdata"):
+        return encode_varint(len(payload)) + b"".join(payload)
+    if kind == "block":
+        return payload
+    if kind == "hello":
+        return payload.encode()
+    data, fee = payload
+    return TX_FEE_STRUCT.pack(fee) + data
+
+
+def decode_gossip_message(frame: bytes):
+    kind = NETWORK_MESSAGE_KINDS.get(frame[0])
+    if kind in ("inv", "getdata"):
+        view = memoryview(frame)
+        count, offset = read_varint(view, 1)
+        if offset + count * INV_ITEM_SIZE != len(frame):
+            raise ValueError("Inventory message length does not match its item count.")
+        return kind, [bytes(view[offset + i * INV_ITEM_SIZE:offset + (i + 1) * INV_ITEM_SIZE]) for i in range(count)]
+    if kind == "block":
+        return kind, frame[1:]
+    if kind == "tx":
+        (fee,) = TX_FEE_STRUCT.unpack_from(frame, 1)
+        return kind, (frame[1 + TX_FEE_STRUCT.size:], fee)
+    if kind == "hello":
+        return kind, str(frame[1:], "utf-8")
+    raise ValueError(f"Unknown network message type: {frame[0]}")
+
+
+def peer_address_key(address):
+    # Адреса пера як ключ пулу з'єднань: шлях Unix-сокета або "host:port"
+    return address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+
+
+def shared_genesis_block():
+    # Генезис-блок з фіксованим часом, однаковий для нод у різних процесах
+    genesis_block = Block("1.0", "0", [], 1)
+    genesis_block.timestamp = 0.0
+    return genesis_block
+
+
+class PeerConnection:
+    """Постійне з'єднання з пером: окремі задачі читання та запису.
+
+    Кадри, відправлені за одну ітерацію циклу подій, записуються одним writelines, а тіло блоку
+    не копіюється в кадр. Запис чекає drain(), тож буфер транспорту обмежений; якщо черга до
+    повільного пера все одно перевищує max_pending_bytes, з'єднання закривається. Наступний кадр
+    читається лише після обробки попереднього, тож повільний отримувач гальмує відправника через TCP.
+    peer_id - ідентифікатор пера (для вхідного з'єднання стає відомим з hello), outbound - хто ініціював.
+    """
+
+    def __init__(self, host, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_pending_bytes: int,
+                 peer_id: str = None, outbound: bool = False):
+        self.host = host
+        self.reader = reader
+        self.writer = writer
+        self.max_pending_bytes = max_pending_bytes
+        self.peer_id = peer_id
+        self.outbound = outbound
+        self.pending = []
+        self.pending_bytes = 0
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._tasks = [asyncio.ensure_future(self._read_loop()), asyncio.ensure_future(self._write_loop())]
+
+    def send(self, kind: str, body: bytes):
+        if self.closed:
+            return
+        self.pending.append(FRAME_STRUCT.pack(len(body) + 1) + bytes([NETWORK_MESSAGE_CODES[kind]]))
+        self.pending.append(body)
+        self.pending_bytes += FRAME_STRUCT.size + 1 + len(body)
+        if self.pending_bytes > self.max_pending_bytes:
+            print("Пер не встигає приймати дані - з'єднання закрито.")
+            self.close()
+            return
+        self._ready.set()
+
+    async def _write_loop(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                batch, self.pending, self.pending_bytes = self.pending, [], 0
+                self.writer.writelines(batch)
+                await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                (length,) = FRAME_STRUCT.unpack(await self.reader.readexactly(FRAME_STRUCT.size))
+                if not 0 < length <= MAX_FRAME_SIZE:
+                    break
+                self.host.on_frame(self, await self.reader.readexactly(length))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (ValueError, IndexError, struct.error):
+            # Невідомий тип повідомлення або пошкоджене тіло - розриваємо з'єднання з пером
+            print("Пер надіслав некоректне повідомлення - з'єднання закрито.")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self.writer.close()
+        self.host.on_disconnect(self)
+
+
+class AsyncNode:
+    """Нода, що спілкується з перами через asyncio; логіку gossip бере з GossipNode.
+
+    Для GossipNode AsyncNode виступає мережею: send() кодує повідомлення і ставить його в чергу
+    з'єднання. Ініціатор з'єднання першим кадром надсилає hello зі своєю адресою; з'єднання в обох
+    напрямках тримаються в пулі за адресою пера, тож з кожним пером є лише одне з'єднання.
+    """
+
+    def __init__(self, node: Node, fanout: int = None, seed: int = 0, max_pending_bytes: int = 8 * 1024 * 1024):
+        self.rng = random.Random(seed)
+        self.gossip = GossipNode(node, self, fanout)
+        self.max_pending_bytes = max_pending_bytes
+        self.connections = {}
+        # Вхідні з'єднання, що ще не надіслали hello
+        self.handshaking = set()
+        self.server = None
+        self.address = None
+        self.node_id = ""
+        self._expiry_task = None
+        self.message_counts = {}
+        self.message_bytes = {}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0, unix_path: str = None):
+        if unix_path is not None:
+            self.server = await asyncio.start_unix_server(self._on_inbound, path=unix_path)
+            self.address = unix_path
+        else:
+            self.server = await asyncio.start_server(self._on_inbound, host, port)
+            self.address = self.server.sockets[0].getsockname()[:2]
+        self.node_id = peer_address_key(self.address)
+        self._expiry_task = asyncio.ensure_future(self._expire_requests())
+
+    async def _expire_requests(self):
+        # Запити, на які пер не відповів, передаються іншим перам, що оголошували ті самі елементи
+        while True:
+            await asyncio.sleep(self.gossip.request_timeout / 2)
+            self.gossip.expire_requests()
+
+    async def _on_inbound(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Пером з'єднання стає лише після hello
+        self.handshaking.add(PeerConnection(self, reader, writer, self.max_pending_bytes))
+
+    def _register(self, connection: PeerConnection):
+        if connection.peer_id:
+            self.connections[connection.peer_id] = connection
+        self.gossip.peers.append(connection)
+
+    def _live_connection(self, peer_id: str):
+        connection = self.connections.get(peer_id)
+        return None if connection is None or connection.closed else connection
+
+    async def connect(self, address):
+        # address - (host, port) для TCP або шлях до Unix-сокета; наявне з'єднання в будь-якому напрямку перевикористовується
+        peer_id = peer_address_key(address)
+        connection = self._live_connection(peer_id)
+        if connection is not None:
+            return connection
+        if isinstance(address, str):
+            reader, writer = await asyncio.open_unix_connection(address)
+        else:
+            reader, writer = await asyncio.open_connection(*address)
+            writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Поки з'єднання встановлювалося, пер міг під'єднатися сам - тоді нове закриваємо ще до hello
+        connection = self._live_connection(peer_id)
+        if connection is not None:
+            writer.close()
+            return connection
+        connection = PeerConnection(self, reader, writer, self.max_pending_bytes, peer_id, outbound=True)
+        self.send(self, connection, "hello", self.node_id, 0)
+        self._register(connection)
+        return connection
+
+    def _on_hello(self, connection: PeerConnection, peer_id: str):
+        if connection.outbound or connection not in self.handshaking:
+            raise ValueError("Unexpected hello message.")
+        self.handshaking.discard(connection)
+        connection.peer_id = peer_id
+        existing = self._live_connection(peer_id) if peer_id else None
+        if existing is None:
+            self._register(connection)
+        elif not existing.outbound or peer_id < self.node_id:
+            # Ноди під'єдналися одна до одної одночасно: обидві лишають з'єднання, ініційоване нодою
+            # з меншим ідентифікатором (або новіше вхідне замість старого)
+            self._register(connection)
+            existing.close()
+        else:
+            connection.close()
+
+    def send(self, sender, recipient: PeerConnection, kind: str, payload, size: int):
+        body = encode_gossip_message(kind, payload)
+        self.message_counts[kind] = self.message_counts.get(kind, 0) + 1
+        self.message_bytes[kind] = self.message_bytes.get(kind, 0) + FRAME_STRUCT.size + 1 + len(body)
+        recipient.send(kind, body)
+
+    def on_frame(self, connection: PeerConnection, frame: bytes):
+        kind, payload = decode_gossip_message(frame)
+        if kind == "hello":
+            self._on_hello(connection, payload)
+        elif connection.peer_id is None:
+            raise ValueError("Message received before hello.")
+        else:
+            self.gossip.handle(connection, kind, payload)
+
+    def on_disconnect(self, connection: PeerConnection):
+        self.handshaking.discard(connection)
+        self.gossip.peer_disconnected(connection)
+        if connection.peer_id and self.connections.get(connection.peer_id) is connection:
+            del self.connections[connection.peer_id]
+
+    async def close(self):
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+        if self.server is not None:
+            self.server.close()
+        for connection in list(self.gossip.peers) + list(self.handshaking):
+            connection.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+
+
+async def _wait_until(condition, timeout: float, interval: float = 0.01):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+def _mine_template_block(node: Node, difficulty_target: int, max_block_bytes: int = 2000):
+    transactions = node.mempool.get_block_template(max_block_bytes)
+    block = Block("1.0", node.blockchain.get_latest_block().block_hash, transactions, difficulty_target)
+    while int(block.block_hash, 16) >= difficulty_target:
+        block.nonce += 1
+    return block
+
+
+# Гарячі ділянки, які вимірюються після METRICS.enable(). Перевірка підписів у пулі процесів
+# рахується в метриках процесів-воркерів і до знімка батьківського процесу не потрапляє
+METRICS.instrument(Transaction, "calculate_digest", "hash.transaction")
+METRICS.instrument(Block, "calculate_hash", "hash.block")
+METRICS.instrument(Block, "calculate_merkle_root", "merkle.root")
+METRICS.instrument(MerkleTree, "__init__", "merkle.build")
+METRICS.instrument(Transaction, "sign_transaction", "ecdsa.sign.transaction")
+METRICS.instrument(Block, "sign_block", "ecdsa.sign.block")
+METRICS.instrument(Transaction, "verify_signature", "ecdsa.verify.transaction")
+METRICS.instrument(Block, "verify_block", "ecdsa.verify.block")
+METRICS.instrument(sys.modules[__name__], "_verify_signature_job", "ecdsa.verify.batch")
+METRICS.instrument(Node, "mine_block", "mining.block")
+METRICS.instrument(Node, "mine_block_parallel", "mining.block_parallel")
+METRICS.instrument(Node, "receive_block", "network.receive_block")
+METRICS.instrument(SyncServer, "handle", "network.sync_request")
+METRICS.instrument(GossipNode, "handle", "network.gossip_message")
+METRICS.instrument(AsyncNode, "on_frame", "network.async_frame")
+METRICS.instrument(Blockchain, "add_block", "chain.add_block")
+
+# Порівняння вартості одного гешу: старий рядковий заголовок проти бінарного з midstate
+def benchmark_header_hashing(iterations: int = 200000):
+    block = Block("1.0", "0" * 64, Node.generate_random_transactions(5), 1)
+
+    def string_header_hash(nonce):
+        block_string = f"{block.version}{block.prevHash}{block.timestamp}{block.difficulty_target}{nonce}{block.MerkleRoot}"
+        return hashlib.sha256(block_string.encode()).hexdigest()
+
+    start_time = time.perf_counter()
+    for nonce in range(iterations):
+        string_header_hash(nonce)
+    string_time = time.perf_counter() - start_time
+
+    midstate = block.header_midstate()
+    pack_nonce = NONCE_STRUCT.pack
+    start_time = time.perf_counter()
+    for nonce in range(iterations):
+        header_hash = midstate.copy()
+        header_hash.update(pack_nonce(nonce))
+        header_hash.digest()
+    midstate_time = time.perf_counter() - start_time
+
+    results = {
+        "string_ns_per_hash": string_time / iterations * 1e9,
+        "midstate_ns_per_hash": midstate_time / iterations * 1e9,
+    }
+    print(f"Рядковий заголовок: {results['string_ns_per_hash']:.0f} нс/геш")
+    print(f"Бінарний заголовок з midstate: {results['midstate_ns_per_hash']:.0f} нс/геш")
+    return results
+
+# Порівняння бінарного формату з JSON-представленням (to_dict) за розміром і швидкістю
+def benchmark_serialization(num_transactions: int = 1000, rounds: int = 20):
+    private_key = SigningKey.generate(curve=SECP256k1)
+    transactions = Node.generate_random_transactions(num_transactions)
+    for tx in transactions:
+        tx.sign_transaction(private_key)
+    block = Block("1.0", Blockchain().get_latest_block().block_hash, transactions, 1)
+    block.sign_block(private_key)
+
+    json_data = json.dumps(block.to_dict()).encode()
+    binary_data = block.to_bytes()
+    assert Block.from_bytes(binary_data).to_dict() == block.to_dict()
+
+    def measure(action):
+        start_time = time.perf_counter()
+        for _ in range(rounds):
+            action()
+        return (time.perf_counter() - start_time) / rounds * 1e3
+
+    results = {
+        "json_size": len(json_data),
+        "binary_size": len(binary_data),
+        "json_encode_ms": measure(lambda: json.dumps(block.to_dict()).encode()),
+        "binary_encode_ms": measure(block.encode),
+        "binary_encode_cached_ms": measure(block.to_bytes),
+        "json_decode_ms": measure(lambda: json.loads(json_data)),
+        "binary_decode_ms": measure(lambda: Block.from_bytes(binary_data)),
+    }
+    print(f"JSON: {results['json_size']} байт, кодування {results['json_encode_ms']:.2f} мс, "
+          f"розбір {results['json_decode_ms']:.2f} мс")
+    print(f"Бінарний: {results['binary_size']} байт, кодування {results['binary_encode_ms']:.2f} мс, "
+          f"декодування {results['binary_decode_ms']:.2f} мс")
+    return results
+
+# Перевірка бінарного формату: python pr3.py --self-test (або pytest pr3.py)
+def test_serialization_round_trip():
+    def assert_transaction_round_trip(tx: Transaction, data):
+        decoded = Transaction.from_bytes(data)
+        assert decoded.to_dict() == tx.to_dict()
+        assert decoded.to_bytes() == tx.to_bytes()
+        assert decoded.verify_hash()
+        return decoded
+
+    def assert_block_round_trip(block: Block, data):
+        decoded = Block.from_bytes(data)
+        assert decoded.to_dict() == block.to_dict()
+        assert decoded.block_hash == block.block_hash
+        assert decoded.to_bytes() == block.to_bytes()
+        assert decoded.verify_merkle_root()
+        return decoded
+
+    # Непідписана транзакція: порожнє поле підпису декодується назад у None
+    unsigned = Transaction("sender", ["receiver_1", "receiver_2"], 12.5)
+    assert assert_transaction_round_trip(unsigned, unsigned.to_bytes()).signature is None
+
+    private_key = SigningKey.generate(curve=SECP256k1)
+    signed = Transaction("sender", ["receiver"], 3.25)
+    signed.sign_transaction(private_key)
+    decoded = assert_transaction_round_trip(signed, signed.to_bytes())
+    assert decoded.verify_signature(private_key.get_verifying_key())
+
+    # Генезис-блок: prevHash "0" і порожній корінь Меркла "" кодуються нульовими байтами
+    genesis_block = Block("1.0", "0", [], 1)
+    assert genesis_block.MerkleRoot == ""
+    decoded = assert_block_round_trip(genesis_block, genesis_block.to_bytes())
+    assert decoded.prevHash == "0" and decoded.MerkleRoot == "" and decoded.transactions == []
+
+    # Порожній блок поверх звичайного батька
+    empty_block = Block("1.0", genesis_block.block_hash, [], 1 << 240, nonce=2 ** 63)
+    assert empty_block.MerkleRoot == ""
+    assert assert_block_round_trip(empty_block, empty_block.to_bytes()).prevHash == genesis_block.block_hash
+
+    # Підписаний блок; вхід - bytes, bytearray або memoryview
+    block = Block("1.0", genesis_block.block_hash, [signed, unsigned], 1 << 250)
+    block.sign_block(private_key)
+    data = block.to_bytes()
+    for buffer in (data, bytearray(data), memoryview(data)):
+        assert assert_block_round_trip(block, buffer).verify_block(private_key.get_verifying_key())
+        assert_transaction_round_trip(signed, type(buffer)(signed.to_bytes()))
+
+    # Багатобайтові varint: граничні значення, довга адреса (довжина поля > 127) і понад 127 транзакцій
+    for value, size in ((0, 1), (127, 1), (128, 2), (300, 2), (16383, 2), (16384, 3), (2 ** 32, 5), (2 ** 63, 10)):
+        encoded = encode_varint(value)
+        assert len(encoded) == size
+        assert read_varint(memoryview(encoded), 0) == (value, size)
+    long_address = Transaction("s" * 300, ["r" * 200], 1.0)
+    assert_transaction_round_trip(long_address, long_address.to_bytes())
+    large_block = Block("1.0", genesis_block.block_hash, Node.generate_random_transactions(300), 1 << 250)
+    assert len(assert_block_round_trip(large_block, large_block.to_bytes()).transactions) == 300
+
+    # Версія блоку займає фіксовані 8 байт заголовка; довша відхиляється, а не обрізається
+    assert Block.from_bytes(Block("1.0.0-b1", "0", [], 1).to_bytes()).version == "1.0.0-b1"
+    try:
+        Block("1.0.0-beta1", "0", [], 1).calculate_hash()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Block version longer than the header field was accepted.")
+
+    # Обрізані дані й зайві байти в кінці відхиляються, а не декодуються частково
+    for obj in (signed, block, large_block):
+        data = obj.to_bytes()
+        for damaged in (data[:-1], data[:-20], data[:len(data) // 2], data + b"garbage", data + b"\0"):
+            try:
+                type(obj).from_bytes(damaged)
+            except (ValueError, struct.error):
+                continue
+            raise AssertionError("Truncated or padded data was accepted.")
+    try:
+        read_varint(memoryview(encode_varint(300)[:1]), 0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Truncated varint was accepted.")
+
+    # Невідома версія формату відхиляється
+    for obj in (signed, block):
+        data = bytearray(obj.to_bytes())
+        data[0] = WIRE_FORMAT_VERSION + 1
+        try:
+            type(obj).from_bytes(data)
+        except ValueError:
+            continue
+        raise AssertionError("Unsupported wire format version was accepted.")
+    print("Бінарний формат: усі перевірки пройдено.")
+
+# Середній обсяг пам'яті на одну підписану транзакцію (для оцінки розміру мемпулу)
+def measure_transaction_memory(num_transactions: int = 100000):
+    signature = SigningKey.generate(curve=SECP256k1).sign(b"")
+    tracemalloc.start()
+    transactions = []
+    for tx in Node.generate_random_transactions(num_transactions):
+        tx.signature = bytes(signature)
+        transactions.append(tx)
+    used_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    bytes_per_tx = used_memory / num_transactions
+    print(f"Пам'ять на транзакцію: {bytes_per_tx:.0f} байт")
+    return bytes_per_tx
+
 # Імітація роботи мережі
 def simulate_network():
     # ств. ключову пару
@@ -165,16 +2261,17 @@ def simulate_network():
     for tx in random_transactions:
         tx.sign_transaction(private_key)
 
-    # ств. блокчейн та кілька нод
-    blockchain_1 = Blockchain()
-    blockchain_2 = Blockchain()
+    # ств. блокчейн та кілька нод; обидві ноди мають спільний генезис-блок
+    genesis_block = Block("1.0", "0", [], 1)
+    blockchain_1 = Blockchain(genesis_block=genesis_block)
+    blockchain_2 = Blockchain(genesis_block=genesis_block)
 
     node_1 = Node(blockchain_1)
     node_2 = Node(blockchain_2)
 
     # майнимо новий блок на першій ноді
     difficulty_target = 0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF
-    new_block = node_1.mine_block(random_transactions, difficulty_target)
+    new_block = node_1.mine_block_parallel(random_transactions, difficulty_target)
 
     # передаємо блок на іншу ноду
     print("\nНода 1 передає блок Ноді 2 для верифікації та додавання:")
@@ -187,5 +2284,160 @@ def simulate_network():
     print("\nБлокчейн ноди 2:")
     print(blockchain_2)
 
-if __name__ == "__main__":
+# Нова нода наздоганяє довгий ланцюг: спочатку заголовки, потім тіла блоків паралельними пакетами
+def simulate_initial_block_download(num_blocks: int = 500, use_socket: bool = True,
+                                    difficulty_target: int = 1 << 250):
+    genesis_block = Block("1.0", "0", [], 1)
+    source = Node(Blockchain(genesis_block=genesis_block))
+    for _ in range(num_blocks):
+        block = Block("1.0", source.blockchain.get_latest_block().block_hash,
+                      Node.generate_random_transactions(3), difficulty_target)
+        while int(block.block_hash, 16) >= difficulty_target:
+            block.nonce += 1
+            block.block_hash = block.calculate_hash()
+        source.blockchain.add_block(block)
+
+    fresh = Node(Blockchain(genesis_block=genesis_block))
+    transports = []
+    if use_socket:
+        server = serve_sync(source.blockchain)
+        connect = lambda: transports.append(SocketTransport(server.server_address)) or transports[-1]
+    else:
+        sync_server = SyncServer(source.blockchain)
+        connect = lambda: transports.append(InProcessTransport(sync_server)) or transports[-1]
+
+    start = time.perf_counter()
+    synced = fresh.sync_from_peer(connect)
+    elapsed = time.perf_counter() - start
+    if use_socket:
+        server.shutdown()
+        server.server_close()
+
+    print(f"Синхронізація {num_blocks} блоків: {'успішно' if synced else 'невдало'}, {elapsed:.3f} с, "
+          f"{sum(transport.round_trips for transport in transports)} обмінів із пером")
+    return fresh
+
+# Поширення блоків і транзакцій через gossip: повний блок передається кожній ноді один раз,
+# а кількість оголошень (по 34 байти) пропорційна кількості з'єднань
+def simulate_gossip(num_nodes: int = 200, degree: int = 8, fanout: int = None, num_blocks: int = 5,
+                    num_transactions: int = 100, difficulty_target: int = 1 << 250, seed: int = 0):
+    genesis_block = Block("1.0", "0", [], 1)
+    network = GossipNetwork(seed)
+    nodes = [GossipNode(Node(Blockchain(genesis_block=genesis_block)), network, fanout) for _ in range(num_nodes)]
+    network.connect_random(nodes, degree)
+
+    for tx in Node.generate_random_transactions(num_transactions):
+        network.rng.choice(nodes).publish_transaction(tx, fee=round(network.rng.uniform(0.1, 1.0), 3))
+    network.run()
+
+    block_bytes = 0
+    for _ in range(num_blocks):
+        miner = network.rng.choice(nodes)
+        transactions = miner.node.mempool.get_block_template(max_block_bytes=2000)
+        block = Block("1.0", miner.node.blockchain.get_latest_block().block_hash, transactions, difficulty_target)
+        while int(block.block_hash, 16) >= difficulty_target:
+            block.nonce += 1
+        block_bytes += len(block.to_bytes())
+        miner.publish_block(block)
+        network.run()
+
+    heights = [node.node.blockchain.best_tip.height for node in nodes]
+    edges = sum(len(node.peers) for node in nodes) // 2
+    print(f"Gossip: {num_nodes} нод, {edges} з'єднань, висоти {min(heights)}..{max(heights)}, "
+          f"мемпули {min(len(node.node.mempool) for node in nodes)}..{max(len(node.node.mempool) for node in nodes)}")
+    print(f"Повідомлення: {network.message_counts}")
+    print(f"Байти: {network.message_bytes}; блоки при повному флудингу: ~{2 * edges * block_bytes} байт")
+    return network, nodes
+
+# Сотні нод в одному процесі, що спілкуються через справжні сокети (TCP на localhost або Unix-сокети)
+def simulate_async_network(num_nodes: int = 100, degree: int = 4, num_blocks: int = 10, num_transactions: int = 200,
+                           use_unix_sockets: bool = False, difficulty_target: int = 1 << 250, seed: int = 0):
+    async def run(socket_dir):
+        rng = random.Random(seed)
+        genesis_block = shared_genesis_block()
+        nodes = [AsyncNode(Node(Blockchain(genesis_block=genesis_block)), seed=seed + i) for i in range(num_nodes)]
+        for i, node in enumerate(nodes):
+            await node.start(unix_path=os.path.join(socket_dir, f"node{i}.sock") if use_unix_sockets else None)
+        links = set()
+        for i, node in enumerate(nodes):
+            for j in rng.sample([j for j in range(num_nodes) if j != i], degree):
+                links.add((min(i, j), max(i, j)))
+                await node.connect(nodes[j].address)
+        # Вхідні з'єднання реєструються після hello - чекаємо, поки кожна пара нод матиме рівно одне з'єднання
+        await _wait_until(lambda: sum(len(node.gossip.peers) for node in nodes) == 2 * len(links), 5.0)
+
+        start = time.perf_counter()
+        for tx in Node.generate_random_transactions(num_transactions):
+            rng.choice(nodes).gossip.publish_transaction(tx, fee=round(rng.uniform(0.1, 1.0), 3))
+        await _wait_until(lambda: all(len(node.gossip.node.mempool) == num_transactions for node in nodes), 30.0)
+
+        for height in range(1, num_blocks + 1):
+            miner = rng.choice(nodes)
+            miner.gossip.publish_block(_mine_template_block(miner.gossip.node, difficulty_target))
+            await _wait_until(lambda: all(node.gossip.node.blockchain.best_tip.height == height for node in nodes),
+                              30.0)
+        elapsed = time.perf_counter() - start
+
+        heights = [node.gossip.node.blockchain.best_tip.height for node in nodes]
+        total_messages = sum(sum(node.message_counts.values()) for node in nodes)
+        total_bytes = sum(sum(node.message_bytes.values()) for node in nodes)
+        print(f"Asyncio-мережа ({'Unix-сокети' if use_unix_sockets else 'TCP'}): {num_nodes} нод, висоти "
+              f"{min(heights)}..{max(heights)}, {elapsed:.2f} с, {total_messages} повідомлень "
+              f"({total_messages / elapsed:.0f}/с), {total_bytes / elapsed / 1e6:.1f} МБ/с")
+        for node in nodes:
+            await node.close()
+        return nodes
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        return asyncio.run(run(socket_dir))
+
+
+# Окремий процес з однією нодою: python pr3.py --serve PORT [HOST:PORT ...] - слухає PORT, під'єднується
+# до вказаних перів і раз на mine_interval секунд майнить блок; кілька таких процесів утворюють мережу
+async def serve_node(port: int, peers: list, mine_interval: float = 5.0, difficulty_target: int = 1 << 250):
+    node = AsyncNode(Node(Blockchain(genesis_block=shared_genesis_block())), seed=port)
+    await node.start(port=port)
+    for host, peer_port in peers:
+        try:
+            await node.connect((host, peer_port))
+        except OSError:
+            print(f"Пер {host}:{peer_port} недоступний.")
+    print(f"Нода слухає порт {port}, перів: {len(node.gossip.peers)}")
+    while True:
+        await asyncio.sleep(mine_interval * random.uniform(0.5, 1.5))
+        node.gossip.publish_block(_mine_template_block(node.gossip.node, difficulty_target))
+        print(f"Висота {node.gossip.node.blockchain.best_tip.height}, перів: {len(node.gossip.peers)}")
+
+# Кілька майнерів паралельно: одночасно знайдені блоки створюють гілки, які розв'язуються сумарною роботою
+def simulate_multi_miner_network(num_miners: int = 4, rounds: int = 6, difficulty_target: int = 1 << 244):
+    # Усі ноди починають зі спільного генезис-блоку
+    genesis_block = Block("1.0", "0", [], 1)
+    nodes = [Node(Blockchain(genesis_block=genesis_block)) for _ in range(num_miners)]
+
+    for round_number in range(rounds):
+        # У кожному раунді блок знаходять один або два майнери одночасно, кожен на своїй вершині
+        miners = random.sample(nodes, random.choice([1, 2]))
+        blocks = [miner.mine_block(Node.generate_random_transactions(2), difficulty_target) for miner in miners]
+        for node in nodes:
+            for block in random.sample(blocks, len(blocks)):
+                node.receive_block(block)
+
+    tips = {node.blockchain.best_tip.block_hash for node in nodes}
+    print(f"\nВершини нод після {rounds} раундів: {len(tips)} різних, висоти "
+          f"{[node.blockchain.best_tip.height for node in nodes]}")
+    return nodes
+
+if __name__ == "__main__" and "--serve" in sys.argv:
+    arguments = sys.argv[sys.argv.index("--serve") + 1:]
+    peer_addresses = [(address.rsplit(":", 1)[0], int(address.rsplit(":", 1)[1])) for address in arguments[1:]]
+    asyncio.run(serve_node(int(arguments[0]), peer_addresses))
+elif __name__ == "__main__" and "--self-test" in sys.argv:
+    test_serialization_round_trip()
+elif __name__ == "__main__":
+    # python pr3.py --metrics - звіт про час у гарячих ділянках і знімок метрик у metrics.jsonl
+    if "--metrics" in sys.argv:
+        METRICS.enable()
     simulate_network()
+    if METRICS.enabled:
+        METRICS.report()
+        METRICS.export(METRICS_PATH)
@@ -1,45 +1,142 @@
+import sys
+import multiprocessing
 import numpy as np
 import matplotlib.pyplot as plt
-from math import exp
+from math import exp, log
+# The minimum-z search and the sweep cache helpers are shared with pr4.py
+from pr4 import search_min_z, load_sweep_cache, save_sweep_cache
 
 
 def attacker_success_probability(q, z, threshold):
     p = 1.0 - q
     lambda_param = z * (q / p)
 
+    if lambda_param == 0:
+        return 0.0
+
+    # Poisson term k is derived from term k - 1 in log space, so one call is O(z)
+    # and exp(-lambda) does not underflow for large z
     sum_prob = 1.0
+    log_poisson = -lambda_param
+    log_lambda = log(lambda_param)
     for k in range(z + 1):
-        poisson = exp(-lambda_param)
-        for i in range(1, k + 1):
-            poisson *= lambda_param / i
-        sum_prob -= poisson * (1 - pow(q / p, z - k))
+        if k > 0:
+            log_poisson += log_lambda - log(k)
+        sum_prob -= exp(log_poisson) * (1 - pow(q / p, z - k))
 
     return sum_prob
 
 
-def find_min_confirmations(q, threshold):
-    z = 1
-    while True:
-        prob = attacker_success_probability(q, z, threshold)
-        if prob < threshold:
-            return z
-        z += 1
-        if z > 1000:
-            return -1
+def attacker_success_curve(q_values, z_max):
+    # P(q, z) for every q in q_values and z = 1..z_max at once, shape (len(q_values), z_max).
+    # Poisson terms are carried in log space from k to k + 1 for the whole (q, z) grid,
+    # and step k only touches the columns z >= k, so the grid costs O(len(q) * z_max^2 / 2).
+    q = np.asarray(q_values, dtype=float)[:, None]
+    log_ratio = np.log(q / (1.0 - q))
+    z = np.arange(1, z_max + 1, dtype=float)[None, :]
+    lambda_param = z * np.exp(log_ratio)
+    log_lambda = np.log(lambda_param)
 
+    log_poisson = -lambda_param
+    caught_up = np.exp(log_poisson) - np.exp(log_poisson + z * log_ratio)
+    for k in range(1, z_max + 1):
+        # Columns z < k are finished, only z >= k receive the k-th term
+        if k > 1:
+            log_poisson = log_poisson[:, 1:]
+        log_poisson = log_poisson + log_lambda[:, k - 1:] - np.log(k)
+        behind = z[:, k - 1:] - k
+        caught_up[:, k - 1:] += np.exp(log_poisson) - np.exp(log_poisson + behind * log_ratio)
+
+    return 1.0 - caught_up
+
+
+def min_confirmations_table(q_values, thresholds, z_max=1000):
+    # First z with P(q, z) < threshold for every (threshold, q) pair, -1 if none up to z_max.
+    # The z range grows 4x per pass and only unresolved q values are recomputed.
+    q_values = np.asarray(q_values, dtype=float)
+    threshold_values = np.asarray(thresholds, dtype=float)
+    table = np.full((len(threshold_values), len(q_values)), -1, dtype=int)
+
+    pending = np.arange(len(q_values))
+    z_limit = 16
+    while pending.size:
+        z_limit = min(z_limit, z_max)
+        curve = attacker_success_curve(q_values[pending], z_limit)
+        below = curve[None, :, :] < threshold_values[:, None, None]
+        found = below.any(axis=2)
+        table[:, pending] = np.where(found, below.argmax(axis=2) + 1, -1)
+        if z_limit == z_max:
+            break
+        pending = pending[~found.all(axis=0)]
+        z_limit *= 4
+
+    return {threshold: table[i].tolist() for i, threshold in enumerate(thresholds)}
+
+
+def find_min_confirmations(q, threshold, z_max=1000):
+    return search_min_z(lambda z: attacker_success_probability(q, z, threshold), threshold, z_max, {}, not_found=-1)
+
+
+def find_min_confirmations_batch(queries, z_max=1000):
+    # Answers many (q, threshold) queries; evaluations are shared between queries with the same q
+    probes_by_q = {}
+    results = []
+    for q, threshold in queries:
+        probes = probes_by_q.setdefault(q, {})
+        results.append(search_min_z(lambda z: attacker_success_probability(q, z, threshold),
+                                    threshold, z_max, probes, not_found=-1))
+    return results
+
+
+# Bump when the model changes so cached points from the old model are not reused
+MODEL_VERSION = "poisson-vectorized-1"
+SWEEP_CACHE_PATH = "pr4.1_sweep_cache.json"
 
-def analyze_and_plot():
-    q_values = np.arange(0.1, 0.46, 0.05)  #  0.1 to 0.45  step 0.05
-    thresholds = [1e-3, 1e-4, 1e-5]
 
-    results = {}
-    for threshold in thresholds:
-        confirmations = []
-        for q in q_values:
-            z = find_min_confirmations(q, threshold)
-            confirmations.append(z)
-        results[threshold] = confirmations
+def _sweep_cache_key(q, threshold):
+    return f"{MODEL_VERSION}|{q:.10g}|{threshold:.10g}"
 
+
+def _sweep_chunk(args):
+    q_chunk, thresholds = args
+    return min_confirmations_table(q_chunk, thresholds)
+
+
+def run_parameter_sweep(q_values, thresholds, cache_path=SWEEP_CACHE_PATH, num_workers=None):
+    # Only (q, threshold) points missing from the on-disk cache are computed,
+    # with the q values split into chunks across a process pool
+    cache = load_sweep_cache(cache_path)
+
+    q_values = [float(q) for q in q_values]
+    missing = sorted({q for q in q_values for threshold in thresholds
+                      if _sweep_cache_key(q, threshold) not in cache})
+    if missing:
+        # Interleaved chunks: large q values (the slow ones) are spread over all workers
+        num_chunks = min(num_workers or multiprocessing.cpu_count(), len(missing))
+        chunks = [(missing[i::num_chunks], thresholds) for i in range(num_chunks)]
+        if len(chunks) == 1:
+            tables = [_sweep_chunk(chunks[0])]
+        else:
+            with multiprocessing.Pool(len(chunks)) as pool:
+                tables = pool.map(_sweep_chunk, chunks)
+        for (q_chunk, _), table in zip(chunks, tables):
+            for threshold in thresholds:
+                for q, z in zip(q_chunk, table[threshold]):
+                    cache[_sweep_cache_key(q, threshold)] = z
+
+        if cache_path:
+            save_sweep_cache(cache, cache_path)
+
+    return {threshold: [cache[_sweep_cache_key(q, threshold)] for q in q_values] for threshold in thresholds}
+
+
+def analyze(q_values=None, thresholds=None, cache_path=SWEEP_CACHE_PATH, num_workers=None):
+    q_values = np.arange(0.1, 0.46, 0.05) if q_values is None else q_values  #  0.1 to 0.45  step 0.05
+    thresholds = [1e-3, 1e-4, 1e-5] if thresholds is None else thresholds
+    return run_parameter_sweep(q_values, thresholds, cache_path, num_workers)
+
+
+def plot_results(q_values, thresholds, results):
     plt.figure(figsize=(10, 6))
     colors = ['b', 'g', 'r']
     markers = ['o', 's', '^']
@@ -56,12 +153,24 @@ def analyze_and_plot():
     plt.legend()
     plt.ylim(bottom=0)
     plt.show()
+
+
+def analyze_and_plot():
+    q_values = np.arange(0.1, 0.46, 0.05)
+    thresholds = [1e-3, 1e-4, 1e-5]
+    results = analyze(q_values, thresholds)
+    plot_results(q_values, thresholds, results)
     return results
 
-results = analyze_and_plot()
 
-print("\nRequired number of confirmations for different attack probabilities:")
-print("\nq\t\tP=10^-3\tP=10^-4\tP=10^-5")
-print("-" * 40)
-for i, q in enumerate(np.arange(0.1, 0.46, 0.05)):
-    print(f"{q:.2f}\t\t{results[1e-3][i]}\t\t{results[1e-4][i]}\t\t{results[1e-5][i]}")
+if __name__ == "__main__":
+    # python pr4.1.py --no-plot runs the sweep headless (batch jobs, no display)
+    results = analyze()
+    if "--no-plot" not in sys.argv:
+        plot_results(np.arange(0.1, 0.46, 0.05), [1e-3, 1e-4, 1e-5], results)
+
+    print("\nRequired number of confirmations for different attack probabilities:")
+    print("\nq\t\tP=10^-3\tP=10^-4\tP=10^-5")
+    print("-" * 40)
+    for i, q in enumerate(np.arange(0.1, 0.46, 0.05)):
+        print(f"{q:.2f}\t\t{results[1e-3][i]}\t\t{results[1e-4][i]}\t\t{results[1e-5][i]}")
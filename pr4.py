@@ -1,4 +1,9 @@
 import math
+import os
+import sys
+import json
+import functools
+import multiprocessing
 from decimal import Decimal, getcontext
 import numpy as np
 import matplotlib.pyplot as plt
@@ -29,33 +34,65 @@ def binomial_coefficient(n, k):
         return 1
 
     # Використання логарифмів для обробки великих чисел
-    log_result = 0
-    for i in range(k):
-        log_result += math.log(n - i)
-        log_result -= math.log(i + 1)
+    return round(math.exp(log_binomial(n, k)))
 
-    return round(math.exp(log_result))
 
+_log_factorials = np.zeros(1)
 
-def calculate_pz_k(z, k, p_h, alpha_m, d_h):
-    """Обчислення P_z(k) за рівнянням з задачі."""
-    if k < 0 or z < 0:
-        return 0
 
-    try:
-        term1 = (p_h ** z) / math.factorial(z - 1)
-        term2 = math.exp(-alpha_m * z * d_h) * ((alpha_m * z * d_h) ** k) / math.factorial(k)
+def log_factorials(n):
+    """Таблиця ln(m!) для m = 0..n; розширюється за потреби та використовується повторно."""
+    global _log_factorials
+    if len(_log_factorials) <= n:
+        _log_factorials = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, 2 * n + 2)))))
+    return _log_factorials
+
+
+def log_binomial(n, k):
+    """ln C(n, k) через таблицю логарифмів факторіалів (працює і для масивів)."""
+    table = log_factorials(int(np.max(n)))
+    return table[n] - table[k] - table[n - k]
+
+
+def logsumexp(values, axis=None):
+    """Стійке обчислення ln(sum(exp(values)))."""
+    max_value = np.max(values, axis=axis, keepdims=True)
+    max_value = np.where(np.isfinite(max_value), max_value, 0.0)
+    result = np.log(np.sum(np.exp(values - max_value), axis=axis, keepdims=True)) + max_value
+    return np.squeeze(result, axis=axis) if axis is not None else result.item()
+
+
+@functools.lru_cache(maxsize=4096)
+def log_pz_k_all(z, p_h, alpha_m, d_h):
+    """ln P_z(k) для всіх k = 0..z за один прохід (масив довжини z + 1)."""
+    x = alpha_m * z * d_h
+    log_x = math.log(x) if x > 0 else -math.inf
+    table = log_factorials(z + 1)
+
+    k = np.arange(z + 1)[:, None]
+    i = np.arange(z + 1)[None, :]
+    inside = i <= k
+    safe_k_minus_i = np.where(inside, k - i, 0)
+    # Доданки суми: (z - i + 1)! * C(k, i) * x^(-i), у логарифмах; i > k не входять у суму
+    with np.errstate(invalid="ignore"):
+        power = np.where(i == 0, 0.0, -i * log_x)
+    log_terms = table[z - i + 1] + table[k] - table[i] - table[safe_k_minus_i] + power
+    log_sum = logsumexp(np.where(inside, log_terms, -np.inf), axis=1)
 
-        sum_term = 0
-        for i in range(k + 1):
-            factorial_term = math.factorial(z - i + 1)
-            binom_coef = binomial_coefficient(k, i)
-            power_term = (alpha_m * z * d_h) ** (-i)
-            sum_term += factorial_term * binom_coef * power_term
+    k = k[:, 0]
+    log_term1 = z * math.log(p_h) - table[z - 1]
+    with np.errstate(invalid="ignore"):
+        log_term2 = -x + np.where(k == 0, 0.0, k * log_x) - table[k]
+    result = log_term1 + log_term2 + log_sum
+    result.flags.writeable = False
+    return result
 
-        return term1 * term2 * sum_term
-    except (OverflowError, ValueError):
+
+def calculate_pz_k(z, k, p_h, alpha_m, d_h):
+    """Обчислення P_z(k) за рівнянням з задачі (у логарифмічному просторі, без переповнень)."""
+    if k < 0 or z < 1 or k > z:
         return 0
+    return math.exp(log_pz_k_all(z, p_h, alpha_m, d_h)[k])
 
 
 def calculate_attack_probability(z, p_h_prime, p_m_prime):
@@ -63,44 +100,258 @@ def calculate_attack_probability(z, p_h_prime, p_m_prime):
     if p_m_prime >= p_h_prime:
         return 1.0
 
-    probability = 0
     ratio = p_m_prime / p_h_prime
-
-    for k in range(z + 1):
-        pz_k = calculate_pz_k(z, k, 1 - p_m_prime, -math.log(p_h_prime) / z, 1)
-        if not math.isnan(pz_k):
-            probability += pz_k * (1 - ratio ** (z - k))
+    k = np.arange(z + 1)
+    pz_k = np.exp(log_pz_k_all(z, 1 - p_m_prime, -math.log(p_h_prime) / z, 1))
+    probability = np.sum(pz_k * (1 - ratio ** (z - k)))
 
     return 1 - probability
 
 
-def find_minimum_confirmations(p_m, alpha, d_h, target_probability=1e-3):
+def search_min_z(probability, target_probability, z_max, probes, not_found=None):
+    """Перший z з probability(z) < target_probability: експоненційний, потім бінарний пошук.
+
+    probes - кеш уже обчислених probability(z), спільний для запитів з тими самими параметрами.
+    Якщо обчислені значення не спадають монотонно, бінарний пошук міг пропустити раніший
+    перетин порогу, тому виконується звичайний перебір z = 1..z_max. Якщо такого z немає,
+    повертається not_found. Спільна реалізація і для pr4.1.py.
+    """
+    def prob(z):
+        if z not in probes:
+            probes[z] = probability(z)
+        return probes[z]
+
+    low, high = 0, 1
+    while prob(high) >= target_probability:
+        if high >= z_max:
+            high = None
+            break
+        low, high = high, min(2 * high, z_max)
+
+    if high is not None:
+        while high - low > 1:
+            middle = (low + high) // 2
+            if prob(middle) < target_probability:
+                high = middle
+            else:
+                low = middle
+
+    probed = [probes[z] for z in sorted(probes)]
+    if all(later <= earlier + 1e-12 for earlier, later in zip(probed, probed[1:])):
+        return high if high is not None else not_found
+
+    for z in range(1, z_max + 1):
+        if prob(z) < target_probability:
+            return z
+    return not_found
+
+
+def find_minimum_confirmations(p_m, alpha, d_h, target_probability=1e-3, z_max=100, probes=None):
     """Знайти мінімальну кількість підтверджень, необхідних для досягнення цільової ймовірності."""
     p_h, alpha_h, alpha_m, p_h_prime, p_m_prime = calculate_probabilities(p_m, alpha, d_h)
+    probes = {} if probes is None else probes
+    return search_min_z(lambda z: calculate_attack_probability(z, p_h_prime, p_m_prime),
+                        target_probability, z_max, probes)
 
-    z = 1
-    while z <= 100:  # Встановлення розумного верхнього обмеження
-        prob = calculate_attack_probability(z, p_h_prime, p_m_prime)
-        if prob < target_probability:
-            return z
-        z += 1
-    return None
+
+def find_minimum_confirmations_batch(queries, z_max=100):
+    """Відповіді на багато запитів (p_m, alpha, d_h, target_probability) зі спільними обчисленнями для однакових параметрів."""
+    probes_by_params = {}
+    results = []
+    for p_m, alpha, d_h, target_probability in queries:
+        probes = probes_by_params.setdefault((p_m, alpha, d_h), {})
+        results.append(find_minimum_confirmations(p_m, alpha, d_h, target_probability, z_max, probes))
+    return results
+
+
+# Версія моделі входить у ключ кешу: після зміни формул старі результати не використовуються
+MODEL_VERSION = "pz-logspace-1"
+SWEEP_CACHE_PATH = "pr4_sweep_cache.json"
+
+
+def load_sweep_cache(cache_path):
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            return json.load(cache_file)
+    return {}
+
+
+def save_sweep_cache(cache, cache_path):
+    # Запис через тимчасовий файл, щоб перерваний запуск не зіпсував кеш
+    with open(cache_path + ".tmp", "w") as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(cache_path + ".tmp", cache_path)
+
+
+def _sweep_cache_key(point):
+    p_m, alpha, d_h, threshold = point
+    return f"{MODEL_VERSION}|{p_m:.10g}|{alpha:.10g}|{d_h:.10g}|{threshold:.10g}"
+
+
+def _sweep_point(point):
+    p_m, alpha, d_h, threshold = point
+    return find_minimum_confirmations(p_m, alpha, d_h, threshold)
 
 
-def analyze_double_spend_attack(alpha=0.00167):
+def run_parameter_sweep(points, cache_path=SWEEP_CACHE_PATH, num_workers=None):
+    """Мінімальні підтвердження для точок (p_m, alpha, d_h, threshold): нові точки рахуються в пулі процесів, решта береться з кешу на диску."""
+    cache = load_sweep_cache(cache_path)
+
+    missing = list({_sweep_cache_key(point): point for point in points
+                    if _sweep_cache_key(point) not in cache}.values())
+    if missing:
+        num_workers = num_workers or multiprocessing.cpu_count()
+        if num_workers == 1:
+            values = [_sweep_point(point) for point in missing]
+        else:
+            with multiprocessing.Pool(num_workers) as pool:
+                values = pool.map(_sweep_point, missing)
+        for point, value in zip(missing, values):
+            cache[_sweep_cache_key(point)] = value
+
+        if cache_path:
+            save_sweep_cache(cache, cache_path)
+
+    return {tuple(point): cache[_sweep_cache_key(point)] for point in points}
+
+
+def analyze_double_spend_attack(alpha=0.00167, p_m_values=None, d_h_values=None, target_probability=1e-3,
+                                cache_path=SWEEP_CACHE_PATH, num_workers=None):
     """Аналіз атаки подвійних витрат для різних параметрів."""
-    p_m_values = np.arange(0.1, 0.45, 0.05)
-    d_h_values = [0, 15, 30, 60, 120, 180]
-    results = {}
+    p_m_values = np.arange(0.1, 0.45, 0.05) if p_m_values is None else p_m_values
+    d_h_values = [0, 15, 30, 60, 120, 180] if d_h_values is None else d_h_values
+    points = [(float(p_m), alpha, d_h, target_probability) for d_h in d_h_values for p_m in p_m_values]
+    sweep = run_parameter_sweep(points, cache_path, num_workers)
 
+    results = {}
     for d_h in d_h_values:
-        confirmations = []
-        for p_m in p_m_values:
-            z = find_minimum_confirmations(p_m, alpha, d_h)
-            confirmations.append(z)
-        results[d_h] = confirmations
+        results[d_h] = [sweep[(float(p_m), alpha, d_h, target_probability)] for p_m in p_m_values]
+
+    return results
+
+
+def _effective_honest_blocks(rng, shape, p_h, alpha_m, d_h):
+    """Масив нових блоків форми shape: True - чесний блок, який встиг поширитися, False - прогрес зловмисника."""
+    honest = rng.random(shape, dtype=np.float32) < p_h
+    if d_h > 0 and alpha_m > 0:
+        # Чесний блок пропадає, якщо зловмисник знаходить свій блок раніше, ніж чесний поширився за d_h
+        honest &= rng.standard_exponential(shape, dtype=np.float32) >= alpha_m * d_h
+    return honest
+
+
+def _simulate_race_chunk(job):
+    """Кількість успішних атак серед num_trials незалежних перегонів зловмисника з чесною мережею."""
+    p_m, alpha, d_h, z, num_trials, seed, truncation, max_deficit = job
+    rng = np.random.default_rng(seed)
+    p_h, alpha_h, alpha_m, p_h_prime, p_m_prime = calculate_probabilities(p_m, alpha, d_h)
+    # Із відставання D зловмисник наздоганяє з імовірністю (p'_m / p'_h)^D, тож перегони, де ця межа
+    # менша за truncation, зупиняємо як програні: похибка оцінки не перевищує truncation
+    if p_m_prime < p_h_prime:
+        max_deficit = min(max_deficit, math.ceil(math.log(truncation) / math.log(p_m_prime / p_h_prime)))
+
+    # Етап 1: блоки надходять, поки продавець не побачить z чесних підтверджень
+    honest = np.zeros(num_trials, dtype=np.int64)
+    attacker = np.zeros(num_trials, dtype=np.int64)
+    active = np.arange(num_trials)
+    while active.size:
+        step = _effective_honest_blocks(rng, active.size, p_h, alpha_m, d_h)
+        honest[active] += step
+        attacker[active] += ~step
+        active = active[honest[active] < z]
+
+    # Етап 2: зловмисник наздоганяє відставання
+    deficit = z - attacker
+    success = deficit <= 0
+    active = np.flatnonzero(~success)
+    deficit = deficit[active]
+    while active.size:
+        step = _effective_honest_blocks(rng, active.size, p_h, alpha_m, d_h)
+        deficit += np.where(step, 1, -1)
+        caught_up = deficit <= 0
+        success[active[caught_up]] = True
+        keep = ~caught_up & (deficit < max_deficit)
+        active = active[keep]
+        deficit = deficit[keep]
+
+    return int(np.count_nonzero(success))
 
-    # Побудова графіка результатів
+
+def wilson_interval(successes, trials, z_score=1.96):
+    """Довірчий інтервал Вілсона для частки успіхів (за замовчуванням 95%)."""
+    if trials == 0:
+        return 0.0, 1.0
+    share = successes / trials
+    denominator = 1 + z_score ** 2 / trials
+    center = (share + z_score ** 2 / (2 * trials)) / denominator
+    half_width = z_score * math.sqrt(share * (1 - share) / trials + z_score ** 2 / (4 * trials ** 2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def monte_carlo_attack_probability(points, num_trials=1_000_000, seed=0, num_workers=None, truncation=1e-9,
+                                   max_deficit=1000, chunk_trials=1 << 18):
+    """Оцінка ймовірності успішної атаки методом Монте-Карло для точок (p_m, alpha, d_h, z).
+
+    Перегони моделюються блок за блоком для всіх спроб одночасно: тип блоку - рівномірна величина,
+    затримка поширення d_h - експоненційний час до наступного блоку зловмисника. Спроби розбиваються
+    на частини по chunk_trials, які рахуються в пулі процесів; зерно кожної частини залежить лише від
+    seed і її номера, тож результат не залежить від кількості процесів. Перегони зупиняються як програні,
+    коли шанс наздогнати стає меншим за truncation або відставання досягає max_deficit.
+    Повертає {точка: (ймовірність, нижня межа, верхня межа 95% інтервалу)}.
+    """
+    points = [tuple(point) for point in points]
+    jobs = []
+    owners = []
+    for point_index, (p_m, alpha, d_h, z) in enumerate(points):
+        for chunk_index, chunk_start in enumerate(range(0, num_trials, chunk_trials)):
+            chunk_size = min(chunk_trials, num_trials - chunk_start)
+            jobs.append((p_m, alpha, d_h, z, chunk_size, [seed, point_index, chunk_index],
+                         truncation, max_deficit))
+            owners.append(point_index)
+
+    num_workers = num_workers or multiprocessing.cpu_count()
+    if num_workers == 1:
+        counts = [_simulate_race_chunk(job) for job in jobs]
+    else:
+        with multiprocessing.Pool(num_workers) as pool:
+            counts = pool.map(_simulate_race_chunk, jobs)
+
+    successes = [0] * len(points)
+    for point_index, count in zip(owners, counts):
+        successes[point_index] += count
+    return {point: (successes[i] / num_trials, *wilson_interval(successes[i], num_trials))
+            for i, point in enumerate(points)}
+
+
+def cross_check_double_spend_attack(alpha=0.00167, p_m_values=None, d_h_values=None, target_probability=1e-3,
+                                    num_trials=1_000_000, seed=0, cache_path=SWEEP_CACHE_PATH, num_workers=None):
+    """Перевірка analyze_double_spend_attack методом Монте-Карло на тій самій сітці (p_m, alpha, d_h, z).
+
+    Для кожної точки з аналітичним мінімумом z повертає (z, аналітична ймовірність, оцінка Монте-Карло,
+    нижня межа, верхня межа); None - аналітичний мінімум не знайдено.
+    """
+    p_m_values = np.arange(0.1, 0.45, 0.05) if p_m_values is None else p_m_values
+    results = analyze_double_spend_attack(alpha, p_m_values, d_h_values, target_probability, cache_path, num_workers)
+    points = [(float(p_m), alpha, d_h, z) for d_h, confirmations in results.items()
+              for p_m, z in zip(p_m_values, confirmations) if z is not None]
+    estimates = monte_carlo_attack_probability(points, num_trials, seed, num_workers)
+
+    comparison = {}
+    for d_h, confirmations in results.items():
+        rows = []
+        for p_m, z in zip(p_m_values, confirmations):
+            if z is None:
+                rows.append(None)
+                continue
+            p_h, alpha_h, alpha_m, p_h_prime, p_m_prime = calculate_probabilities(float(p_m), alpha, d_h)
+            analytic = float(calculate_attack_probability(z, p_h_prime, p_m_prime))
+            rows.append((z, analytic, *estimates[(float(p_m), alpha, d_h, z)]))
+        comparison[d_h] = rows
+    return comparison
+
+
+def plot_double_spend_results(results, alpha, p_m_values=None):
+    """Побудова графіка результатів analyze_double_spend_attack."""
+    p_m_values = np.arange(0.1, 0.45, 0.05) if p_m_values is None else p_m_values
     plt.figure(figsize=(12, 8))
     for d_h, conf in results.items():
         plt.plot(p_m_values, conf, marker='o', label=f'D_H = {d_h}')
@@ -112,12 +363,35 @@ def analyze_double_spend_attack(alpha=0.00167):
     plt.grid(True)
     plt.show()
 
-    return results
 
-# Запуск аналізу для заданого α
-print("Запуск аналізу для α = 0.00167...")
-results_1 = analyze_double_spend_attack(alpha=0.00167)
+if __name__ == "__main__":
+    # python pr4.py --no-plot - лише розрахунок (наприклад, у пакетному режимі без дисплея)
+    show_plots = "--no-plot" not in sys.argv
+
+    # python pr4.py --monte-carlo - порівняння аналітичних ймовірностей із моделюванням перегонів
+    if "--monte-carlo" in sys.argv:
+        for alpha in (0.00167, 0.003):
+            comparison = cross_check_double_spend_attack(alpha=alpha)
+            for d_h, rows in comparison.items():
+                for p_m, row in zip(np.arange(0.1, 0.45, 0.05), rows):
+                    if row is None:
+                        continue
+                    z, analytic, estimate, low, high = row
+                    mark = "" if low <= analytic <= high else "  <- поза інтервалом"
+                    print(f"α = {alpha}, D_H = {d_h}, p_M = {p_m:.2f}, z = {z}: аналітично {analytic:.6f}, "
+                          f"Монте-Карло {estimate:.6f} [{low:.6f}, {high:.6f}]{mark}")
+        sys.exit(0)
+
+    # Запуск аналізу для заданого α
+    print("Запуск аналізу для α = 0.00167...")
+    results_1 = analyze_double_spend_attack(alpha=0.00167)
+
+    # Запуск аналізу для іншого α (наприклад, α = 0.003)
+    print("\nЗапуск аналізу для α = 0.003...")
+    results_2 = analyze_double_spend_attack(alpha=0.003)
 
-# Запуск аналізу для іншого α (наприклад, α = 0.003)
-print("\nЗапуск аналізу для α = 0.003...")
-results_2 = analyze_double_spend_attack(alpha=0.003)
\ No newline at end of file
+    for alpha, results in ((0.00167, results_1), (0.003, results_2)):
+        for d_h, confirmations in results.items():
+            print(f"α = {alpha}, D_H = {d_h}: {confirmations}")
+        if show_plots:
+            plot_double_spend_results(results, alpha)
\ No newline at end of file
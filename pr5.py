@@ -1,11 +1,21 @@
 import hashlib
 import time
 import json
+import sys
+import platform
+import tracemalloc
 import random
 import base64
+import heapq
+import numpy as np
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
-from threading import Thread
 import matplotlib.pyplot as plt
+from pr3 import Metrics, METRICS_PATH
+
+
+# Клас Metrics спільний з pr3.py; тут - власний реєстр для класів цього файлу
+METRICS = Metrics()
+
 
 class Transaction:
     def __init__(self, sender: str, receivers: list, amount: float):
@@ -16,6 +26,13 @@ class Transaction:
         self.txHash = self.calculate_hash()
         self.signature = None
 
+    def __setattr__(self, name, value):
+        # Обчислений геш і словник для серіалізації кешуються; зміна будь-якого поля їх скидає
+        super().__setattr__(name, value)
+        if name[0] != "_":
+            self.__dict__["_calculated_hash"] = None
+            self.__dict__["_dict"] = None
+
     def calculate_hash(self):
         tx_string = f"{self.input}{'|'.join(self.output)}{self.amount}{self.txTimestamp}"
         return hashlib.sha256(tx_string.encode()).hexdigest()
@@ -29,22 +46,41 @@ class Transaction:
         return self.signature and public_key.verify(self.signature, self.txHash.encode())
 
     def verify_hash(self):
-        return self.txHash == self.calculate_hash()
+        if self._calculated_hash is None:
+            self._calculated_hash = self.calculate_hash()
+        return self.txHash == self._calculated_hash
 
     def to_dict(self):
-        return {
-            "input": self.input,
-            "output": self.output,
-            "amount": self.amount,
-            "txTimestamp": self.txTimestamp,
-            "txHash": self.txHash,
-            "signature": base64.b64encode(self.signature).decode() if self.signature else None
-        }
+        # Словник спільний для всіх викликів до наступної зміни транзакції - його не можна змінювати
+        if self._dict is None:
+            self._dict = {
+                "input": self.input,
+                "output": self.output,
+                "amount": self.amount,
+                "txTimestamp": self.txTimestamp,
+                "txHash": self.txHash,
+                "signature": base64.b64encode(self.signature).decode() if self.signature else None
+            }
+        return self._dict
 
     def __str__(self):
         return json.dumps(self.to_dict(), indent=4)
 
 class Block:
+    # Геш блоку, корінь Меркла і серіалізований блок обчислюються один раз і кешуються; зміна поля скидає
+    # залежні кеші. Корінь Меркла звіряється з поточними гешами транзакцій, а серіалізація - зі словниками
+    # транзакцій, тож зміна транзакції теж їх скидає
+    _INVALIDATES = {
+        "version": ("_block_hash", "_serialized"),
+        "prevHash": ("_block_hash", "_serialized"),
+        "timestamp": ("_block_hash", "_serialized"),
+        "difficulty_target": ("_block_hash", "_serialized"),
+        "nonce": ("_block_hash", "_serialized"),
+        "MerkleRoot": ("_block_hash", "_serialized"),
+        "signature": ("_serialized",),
+        "transactions": ("_merkle_root", "_serialized"),
+    }
+
     def __init__(self, version: str, prev_hash: str, transactions: list, difficulty_target: int, nonce: int = 0):
         self.version = version
         self.prevHash = prev_hash
@@ -53,11 +89,33 @@ class Block:
         self.nonce = nonce
         self.transactions = transactions
         self.MerkleRoot = self.calculate_merkle_root()
-        self.block_hash = self.calculate_hash()
         self.signature = None
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        for cache_name in self._INVALIDATES.get(name, ()):
+            self.__dict__[cache_name] = None
+
+    @property
+    def block_hash(self):
+        if self._block_hash is None:
+            self._block_hash = self.calculate_hash()
+        return self._block_hash
+
+    @block_hash.setter
+    def block_hash(self, value: str):
+        self._block_hash = value
+        self.__dict__["_serialized"] = None
+
     def calculate_merkle_root(self):
         transaction_hashes = [tx.txHash for tx in self.transactions]
+        if self._merkle_root is None or self._merkle_leaves != transaction_hashes:
+            self._merkle_root = self._merkle_root_of(transaction_hashes)
+            self._merkle_leaves = transaction_hashes
+        return self._merkle_root
+
+    @staticmethod
+    def _merkle_root_of(transaction_hashes):
         if not transaction_hashes:
             return ""
         while len(transaction_hashes) > 1:
@@ -99,58 +157,207 @@ class Block:
             "signature": base64.b64encode(self.signature).decode() if self.signature else None
         }
 
+    def serialized(self):
+        # Серіалізований блок для розсилки: кодується один раз і повторно використовується для кожного пера
+        tx_dicts = [tx.to_dict() for tx in self.transactions]
+        if self._serialized is None or len(self._serialized_txs) != len(tx_dicts) \
+                or any(tx_dict is not cached for tx_dict, cached in zip(tx_dicts, self._serialized_txs)):
+            self._serialized = json.dumps(self.to_dict()).encode()
+            self._serialized_txs = tx_dicts
+        return self._serialized
+
     def __str__(self):
         return json.dumps(self.to_dict(), indent=4)
 
 class Blockchain:
     def __init__(self):
+        # chain - індекс висота -> блок, blocks_by_hash - індекс геш -> блок
         self.chain = []
+        self.blocks_by_hash = {}
         self.create_genesis_block()
 
     def create_genesis_block(self):
         genesis_block = Block("1.0", "0", [], 1)
-        self.chain.append(genesis_block)
+        self._append(genesis_block)
+
+    def _append(self, block: Block):
+        self.chain.append(block)
+        self.blocks_by_hash[block.block_hash] = block
 
     def add_block(self, new_block: Block):
-        if any(block.block_hash == new_block.block_hash for block in self.chain):
+        if new_block.block_hash in self.blocks_by_hash:
             return False
-        self.chain.append(new_block)
+        self._append(new_block)
         return True
 
     def get_latest_block(self):
         return self.chain[-1]
 
+    def get_block(self, block_hash: str):
+        return self.blocks_by_hash.get(block_hash)
+
+    def get_block_at(self, height: int):
+        if 0 <= height < len(self.chain):
+            return self.chain[height]
+        return None
+
     def __str__(self):
         return "\n".join(str(block) for block in self.chain)
 
 
+# Розподіли затримки каналу: функція (відправник, масив отримувачів, rng) -> масив затримок у секундах,
+# тож затримка може залежати від конкретного каналу
+def constant_latency(delay=0.1):
+    return lambda sender_id, recipients, rng: np.full(len(recipients), delay)
+
+
+def uniform_latency(low=0.05, high=0.15):
+    return lambda sender_id, recipients, rng: rng.uniform(low, high, len(recipients))
+
+
+def exponential_latency(mean=0.1, minimum=0.0):
+    return lambda sender_id, recipients, rng: minimum + rng.exponential(mean, len(recipients))
+
+
+class DeliveryBuffer:
+    """Кільцевий буфер лічильників доставки: рядок - такт віртуального часу, стовпець - вузол-отримувач."""
+
+    def __init__(self, num_nodes, window=64):
+        self.counts = np.zeros((window, num_nodes), dtype=np.int32)
+        self.row_ticks = np.full(window, -1, dtype=np.int64)
+
+    def ensure_window(self, first_tick, last_tick):
+        window = len(self.row_ticks)
+        if last_tick - first_tick < window:
+            return
+        new_window = 1 << int(last_tick - first_tick).bit_length()
+        counts = np.zeros((new_window, self.counts.shape[1]), dtype=np.int32)
+        row_ticks = np.full(new_window, -1, dtype=np.int64)
+        for row in np.flatnonzero(self.row_ticks >= 0):
+            tick = self.row_ticks[row]
+            counts[tick % new_window] = self.counts[row]
+            row_ticks[tick % new_window] = tick
+        self.counts, self.row_ticks = counts, row_ticks
+
+    def take(self, tick):
+        row = tick % len(self.row_ticks)
+        delivered = self.counts[row].copy()
+        self.counts[row] = 0
+        self.row_ticks[row] = -1
+        return delivered
+
+
+class Network:
+    """Дискретно-подійна симуляція мережі: віртуальний годинник і черга подій з пріоритетом за часом."""
+
+    def __init__(self, num_nodes, latency=None, seed=0, time_step=0.001):
+        self.now = 0.0
+        self.events = []
+        self._sequence = 0
+        self.latency = latency or constant_latency()
+        self.rng = np.random.default_rng(seed)
+        self.time_step = time_step
+        self.node_ids = np.arange(num_nodes)
+        # Лічильники голосів зберігаються масивом, щоб доставка групи повідомлень була однією операцією
+        self.valid_counts = np.zeros(num_nodes, dtype=np.int64)
+        # обробник -> DeliveryBuffer з повідомленнями, що ще не доставлені
+        self._buffers = {}
+        self.messages_sent = 0
+        self.events_processed = 0
+
+    def schedule(self, delay, callback, *args):
+        # Порядковий номер розв'язує рівність часу детерміновано - у порядку планування
+        heapq.heappush(self.events, (self.now + delay, self._sequence, callback, args))
+        self._sequence += 1
+
+    def broadcast(self, sender_id, recipients, handler):
+        # Затримки округлюються до time_step; всі повідомлення (від усіх відправників) з тим самим
+        # тактом доставки та обробником стають однією подією, а обробник отримує масив
+        # "скільки повідомлень прийшло кожному вузлу". recipients не повинні повторюватися.
+        if len(recipients) == 0:
+            return
+        delays = self.latency(sender_id, recipients, self.rng)
+        current_tick = round(self.now / self.time_step)
+        ticks = current_tick + np.maximum(np.rint(np.asarray(delays) / self.time_step).astype(np.int64), 0)
+
+        buffer = self._buffers.get(handler)
+        if buffer is None:
+            buffer = self._buffers[handler] = DeliveryBuffer(len(self.node_ids))
+        first_tick = int(ticks.min())
+        buffer.ensure_window(current_tick, int(ticks.max()))
+        window = len(buffer.row_ticks)
+        buffer.counts[ticks % window, recipients] += 1
+
+        for tick in (first_tick + np.flatnonzero(np.bincount(ticks - first_tick))).tolist():
+            if buffer.row_ticks[tick % window] != tick:
+                buffer.row_ticks[tick % window] = tick
+                self.schedule(tick * self.time_step - self.now, self._deliver, handler, tick)
+        self.messages_sent += len(recipients)
+        if METRICS.enabled:
+            METRICS.count("network.messages", len(recipients))
+
+    def _deliver(self, handler, tick):
+        handler(self._buffers[handler].take(tick))
+
+    def send(self, sender_id, recipients, handler, *payload):
+        # Повідомлення з вмістом: handler(група отримувачів, *payload) викликається один раз
+        # для кожної групи отримувачів з однаковим тактом доставки
+        if len(recipients) == 0:
+            return
+        delays = self.latency(sender_id, recipients, self.rng)
+        ticks = np.maximum(np.rint(np.asarray(delays) / self.time_step).astype(np.int64), 0)
+        order = np.argsort(ticks, kind="stable")
+        ticks = ticks[order]
+        recipients = recipients[order]
+        unique_ticks, starts = np.unique(ticks, return_index=True)
+        for tick, group in zip(unique_ticks.tolist(), np.split(recipients, starts[1:])):
+            self.schedule(tick * self.time_step, handler, group, *payload)
+        self.messages_sent += len(recipients)
+        if METRICS.enabled:
+            METRICS.count("network.messages", len(recipients))
+
+    def deliver_valid(self, delivered):
+        self.valid_counts += delivered
+
+    def run(self, until=None):
+        while self.events and (until is None or self.events[0][0] <= until):
+            event_time, _, callback, args = heapq.heappop(self.events)
+            self.now = event_time
+            callback(*args)
+            self.events_processed += 1
+        return self.now
+
+
 class Node:
-    def __init__(self, blockchain: Blockchain, node_id: int):
+    def __init__(self, blockchain: Blockchain, node_id: int, network: Network = None):
         self.blockchain = blockchain
         self.node_id = node_id
+        self.network = network or Network(node_id + 1)
         self.valid_votes = 0
-        self.received_valid_msgs = 0
+
+    @property
+    def received_valid_msgs(self):
+        return int(self.network.valid_counts[self.node_id])
 
     def mine_block(self, transactions, difficulty_target):
-        nonce = 0
-        while True:
-            new_block = Block("1.0", self.blockchain.chain[-1].block_hash, transactions, difficulty_target, nonce)
-            if new_block.block_hash.startswith("0000"):  # Перевірка складності
-                return new_block
-            nonce += 1
+        # Блок створюється один раз: зміна nonce скидає лише кешований геш, корінь Меркла не перераховується
+        new_block = Block("1.0", self.blockchain.chain[-1].block_hash, transactions, difficulty_target)
+        while not new_block.block_hash.startswith("0000"):  # Перевірка складності
+            new_block.nonce += 1
+        if METRICS.enabled:
+            METRICS.count("mining.iterations", new_block.nonce + 1)
+        return new_block
 
     def receive_block(self, block: Block, nodes):
         if self.validate_block(block):
-            for node in nodes:
-                if node != self:
-                    Thread(target=self.send_valid, args=(node,)).start()
+            peers = np.delete(self.network.node_ids[:len(nodes)], self.node_id)
+            self.network.broadcast(self.node_id, peers, self.network.deliver_valid)
 
     def send_valid(self, node):
-        time.sleep(0.1)  # Затримка в 100 мс для симуляції передачі
-        node.receive_valid()
+        self.network.broadcast(self.node_id, np.array([node.node_id]), self.network.deliver_valid)
 
     def receive_valid(self):
-        self.received_valid_msgs += 1
+        self.network.valid_counts[self.node_id] += 1
 
     def validate_block(self, block: Block):
         return block.block_hash.startswith("0000") and block.verify_merkle_root()  # перевірка підпису та транзакцій
@@ -161,9 +368,274 @@ class Node:
  #           print(f"Блок успішно додано до ланцюга в вузлі {self.node_id}")
 
 
-def bft_protocol(num_nodes):
+PRE_PREPARE = "pre-prepare"
+PREPARE = "prepare"
+COMMIT = "commit"
+VIEW_CHANGE = "view-change"
+NEW_VIEW = "new-view"
+
+
+class QuorumCertificate:
+    """Голоси однієї фази для (view, sequence, геш блоку): бітова множина вузлів і їх кількість."""
+    __slots__ = ("phase", "view", "sequence", "block_hash", "votes", "count")
+
+    def __init__(self, phase, view, sequence, block_hash):
+        self.phase = phase
+        self.view = view
+        self.sequence = sequence
+        self.block_hash = block_hash
+        self.votes = 0
+        self.count = 0
+
+    def add_vote(self, node_id):
+        bit = 1 << node_id
+        if self.votes & bit:
+            return False
+        self.votes |= bit
+        self.count += 1
+        return True
+
+    def merge(self, votes):
+        # Об'єднання з агрегованим сертифікатом від лідера; повторні голоси не рахуються
+        new_votes = votes & ~self.votes
+        self.votes |= new_votes
+        self.count += new_votes.bit_count()
+
+    def voters(self):
+        return [node_id for node_id in range(self.votes.bit_length()) if self.votes >> node_id & 1]
+
+
+class PBFTReplica:
+    """Репліка PBFT: pre-prepare -> prepare -> commit, зміна виду за тайм-аутом."""
+
+    def __init__(self, cluster, node: Node, faulty=False):
+        self.cluster = cluster
+        self.node = node
+        self.node_id = node.node_id
+        self.faulty = faulty
+        self.view = 0
+        self.pending_request = None
+        self.blocks = {}           # (view, sequence) -> блок з pre-prepare
+        self.certificates = {}     # (фаза, view, sequence, геш блоку) -> QuorumCertificate
+        self.prepared = set()
+        self.committed = set()
+        self.new_views_sent = set()
+        self.block_received_at = None
+        self.finalized_at = None
+
+    def certificate(self, phase, view, sequence, block_hash):
+        key = (phase, view, sequence, block_hash)
+        certificate = self.certificates.get(key)
+        if certificate is None:
+            certificate = self.certificates[key] = QuorumCertificate(phase, view, sequence, block_hash)
+        return certificate
+
+    def submit(self, block: Block):
+        # Запит клієнта отримують усі репліки; первинна пропонує його, решта чекають з тайм-аутом
+        self.pending_request = block
+        self._start_timer()
+        if self.cluster.primary(self.view) == self.node_id:
+            self._propose(block, self.cluster.next_sequence)
+
+    def _start_timer(self):
+        self.cluster.network.schedule(self.cluster.view_change_timeout, self._on_timeout, self.view)
+
+    def _propose(self, block: Block, sequence):
+        self.cluster.send(self, self.cluster.other_ids(self.node_id), PRE_PREPARE, self.view, sequence, block)
+        self.on_pre_prepare(self.node_id, self.view, sequence, block)
+
+    def on_pre_prepare(self, sender, view, sequence, block: Block):
+        if view != self.view or sender != self.cluster.primary(view) or (view, sequence) in self.blocks:
+            return
+        if not self.node.validate_block(block):
+            return
+        self.blocks[(view, sequence)] = block
+        if self.block_received_at is None:
+            self.block_received_at = self.cluster.network.now
+        self._vote(PREPARE, view, sequence, block.block_hash)
+        self._check_progress(view, sequence)
+
+    def _vote(self, phase, view, sequence, block_hash):
+        # Без агрегації голос розсилається всім (O(n^2) повідомлень на фазу),
+        # з агрегацією - лише первинній репліці, яка потім розсилає один сертифікат (O(n))
+        self.certificate(phase, view, sequence, block_hash).add_vote(self.node_id)
+        primary = self.cluster.primary(view)
+        if self.cluster.aggregate:
+            if primary != self.node_id:
+                self.cluster.send(self, np.array([primary]), phase, view, sequence, block_hash, self.node_id)
+        else:
+            self.cluster.send(self, self.cluster.other_ids(self.node_id), phase, view, sequence, block_hash,
+                              self.node_id)
+
+    def on_vote(self, phase, view, sequence, block_hash, voter):
+        certificate = self.certificate(phase, view, sequence, block_hash)
+        had_quorum = certificate.count >= self.cluster.quorum
+        certificate.add_vote(voter)
+        if self.cluster.aggregate and not had_quorum and certificate.count >= self.cluster.quorum:
+            self.cluster.send(self, self.cluster.other_ids(self.node_id), phase + "-qc", view, sequence,
+                              block_hash, certificate.votes)
+        self._check_progress(view, sequence)
+
+    def on_certificate(self, phase, view, sequence, block_hash, votes):
+        self.certificate(phase, view, sequence, block_hash).merge(votes)
+        self._check_progress(view, sequence)
+
+    def _check_progress(self, view, sequence):
+        # Фаза завершується щойно набрано кворум, незалежно від порядку надходження повідомлень
+        block = self.blocks.get((view, sequence))
+        if block is None:
+            return
+        quorum = self.cluster.quorum
+        if (view, sequence) not in self.prepared and \
+                self.certificate(PREPARE, view, sequence, block.block_hash).count >= quorum:
+            self.prepared.add((view, sequence))
+            self._vote(COMMIT, view, sequence, block.block_hash)
+        if (view, sequence) in self.prepared and sequence not in self.committed and \
+                self.certificate(COMMIT, view, sequence, block.block_hash).count >= quorum:
+            self.committed.add(sequence)
+            self.finalized_at = self.cluster.network.now
+            self.node.blockchain.add_block(block)
+
+    def _on_timeout(self, view):
+        if self.committed or view != self.view:
+            return
+        # Без кворуму чесних реплік або після max_views змін виду таймер більше не заводимо -
+        # інакше черга подій ніколи не спорожніє
+        new_view = view + 1
+        if not self.cluster.quorum_reachable or new_view > self.cluster.max_views:
+            return
+        # Первинна репліка не довела запит до кінця - голосуємо за перехід до наступного виду
+        self.view = new_view
+        new_primary = self.cluster.primary(new_view)
+        self.certificate(VIEW_CHANGE, new_view, 0, "").add_vote(self.node_id)
+        recipients = np.array([new_primary]) if self.cluster.aggregate else self.cluster.other_ids(self.node_id)
+        if new_primary != self.node_id:
+            self.cluster.send(self, recipients, VIEW_CHANGE, new_view, 0, "", self.node_id)
+        self._check_new_view(new_view)
+        self._start_timer()
+
+    def on_view_change(self, new_view, voter):
+        self.certificate(VIEW_CHANGE, new_view, 0, "").add_vote(voter)
+        self._check_new_view(new_view)
+
+    def _check_new_view(self, new_view):
+        if self.cluster.primary(new_view) != self.node_id or new_view in self.new_views_sent:
+            return
+        if self.certificate(VIEW_CHANGE, new_view, 0, "").count >= self.cluster.quorum:
+            self.new_views_sent.add(new_view)
+            self.view = new_view
+            self.cluster.send(self, self.cluster.other_ids(self.node_id), NEW_VIEW, new_view)
+            if not self.committed and self.pending_request is not None:
+                self._propose(self.pending_request, self.cluster.next_sequence)
+
+    def on_new_view(self, sender, new_view):
+        if sender == self.cluster.primary(new_view) and new_view >= self.view and not self.committed:
+            self.view = new_view
+
+
+# Оцінка розміру повідомлень у байтах: тип (1), view (8), sequence (8), геш блоку (32), вузол (4), підпис (64)
+VOTE_MESSAGE_SIZE = 1 + 8 + 8 + 32 + 4 + 64
+NEW_VIEW_MESSAGE_SIZE = 1 + 8 + 64
+
+
+class PBFTCluster:
+    """Набір реплік PBFT поверх дискретно-подійної мережі; рахує повідомлення та байти за фазами."""
+
+    def __init__(self, nodes, network: Network, aggregate=False, view_change_timeout=1.0, faulty_nodes=(),
+                 max_views=None):
+        self.network = network
+        self.aggregate = aggregate
+        self.view_change_timeout = view_change_timeout
+        self.num_nodes = len(nodes)
+        self.f = (self.num_nodes - 1) // 3
+        self.quorum = 2 * self.f + 1
+        # За замовчуванням кожна репліка один раз отримує шанс бути первинною
+        self.max_views = self.num_nodes if max_views is None else max_views
+        self.next_sequence = 1
+        faulty_nodes = set(faulty_nodes)
+        self.replicas = [PBFTReplica(self, node, node.node_id in faulty_nodes) for node in nodes]
+        self.honest_count = sum(not replica.faulty for replica in self.replicas)
+        self.quorum_reachable = self.honest_count >= self.quorum
+        self.message_counts = {}
+        self.message_bytes = {}
+
+    def message_size(self, kind, payload):
+        if kind == PRE_PREPARE:
+            return 1 + 8 + 8 + len(payload[2].serialized())
+        if kind.endswith("-qc"):
+            # Агрегований сертифікат: бітова множина на n вузлів і один агрегований підпис
+            return 1 + 8 + 8 + 32 + (self.num_nodes + 7) // 8 + 64
+        if kind == NEW_VIEW:
+            return NEW_VIEW_MESSAGE_SIZE
+        return VOTE_MESSAGE_SIZE
+
+    def primary(self, view):
+        return view % self.num_nodes
+
+    def other_ids(self, node_id):
+        return np.delete(self.network.node_ids[:self.num_nodes], node_id)
+
+    def send(self, sender: PBFTReplica, recipients, kind, *payload):
+        if sender.faulty:
+            return
+        self.message_counts[kind] = self.message_counts.get(kind, 0) + len(recipients)
+        self.message_bytes[kind] = self.message_bytes.get(kind, 0) + len(recipients) * self.message_size(kind, payload)
+        self.network.send(sender.node_id, recipients, self._dispatch, sender.node_id, kind, payload)
+
+    def _dispatch(self, recipients, sender_id, kind, payload):
+        for node_id in recipients.tolist():
+            replica = self.replicas[node_id]
+            if replica.faulty:
+                continue
+            if kind == PRE_PREPARE:
+                replica.on_pre_prepare(sender_id, *payload)
+            elif kind in (PREPARE, COMMIT):
+                replica.on_vote(kind, *payload)
+            elif kind.endswith("-qc"):
+                replica.on_certificate(kind[:-len("-qc")], *payload)
+            elif kind == VIEW_CHANGE:
+                replica.on_view_change(payload[0], payload[3])
+            elif kind == NEW_VIEW:
+                replica.on_new_view(sender_id, *payload)
+
+    def submit(self, block: Block):
+        for replica in self.replicas:
+            if not replica.faulty:
+                replica.submit(block)
+
+    def finalized_replicas(self):
+        return [replica for replica in self.replicas if replica.committed]
+
+
+def pbft_protocol(num_nodes, aggregate=False, latency=None, seed=0, faulty_nodes=(), block=None):
+    network = Network(num_nodes, latency, seed)
+    nodes = [Node(Blockchain(), i, network) for i in range(num_nodes)]
+    cluster = PBFTCluster(nodes, network, aggregate, faulty_nodes=faulty_nodes)
+
+    if block is None:
+        transactions = [Transaction(f"sender_{i}", [f"receiver_{i}"], random.uniform(1, 100)) for i in range(5)]
+        block = nodes[0].mine_block(transactions,
+                                    difficulty_target=0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+
+    cluster.submit(block)
+    # Кожен вид триває не довше за тайм-аут, тож після max_views змін виду симуляцію можна зупинити;
+    # після фіналізації в черзі лишаються тільки тайм-аути, які вже нічого не змінюють
+    network.run(until=(cluster.max_views + 2) * cluster.view_change_timeout)
+
+    finalized = cluster.finalized_replicas()
+    label = f"PBFT ({'з агрегацією' if aggregate else 'всі-до-всіх'}), {num_nodes} вузлів"
+    if finalized:
+        print(f"{label}: блок фіналізували {len(finalized)} вузлів, повідомлень: {network.messages_sent}")
+    else:
+        print(f"{label}: блок не фіналізовано (чесних вузлів {cluster.honest_count}, кворум {cluster.quorum}), "
+              f"повідомлень: {network.messages_sent}")
+    return cluster
+
+
+def bft_protocol(num_nodes, latency=None, seed=0):
     blockchain = Blockchain()
-    nodes = [Node(blockchain, i) for i in range(num_nodes)]
+    network = Network(num_nodes, latency, seed)
+    nodes = [Node(blockchain, i, network) for i in range(num_nodes)]
     transactions = [Transaction(f"sender_{i}", [f"receiver_{i}"], random.uniform(1, 100)) for i in range(5)]
     leader_node = nodes[0]
 
@@ -173,19 +645,99 @@ def bft_protocol(num_nodes):
                                        difficulty_target=0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
     print(f"Правильний нонсе знайдено: {new_block.nonce}")
 
-    threads = []
+    # Кожен вузол отримує блок у момент 0 віртуального часу, далі працює лише черга подій
     for node in nodes:
-        thread = Thread(target=node.receive_block, args=(new_block, nodes))
-        threads.append(thread)
-        thread.start()
-
-    for thread in threads:
-        thread.join()
+        network.schedule(0.0, node.receive_block, new_block, nodes)
+    network.run()
 
     for node in nodes:
         node.finalize_block(new_block, num_nodes)
 
-    print("Блок успішно додано до ланцюга")
+    print(f"Блок успішно додано до ланцюга (повідомлень: {network.messages_sent}, "
+          f"віртуальний час: {network.now:.3f} с)")
+    return network
+
+
+# Гарячі ділянки, які вимірюються після METRICS.enable()
+METRICS.instrument(Transaction, "calculate_hash", "hash.transaction")
+METRICS.instrument(Block, "calculate_hash", "hash.block")
+METRICS.instrument(Block, "calculate_merkle_root", "merkle.root")
+METRICS.instrument(Transaction, "sign_transaction", "ecdsa.sign.transaction")
+METRICS.instrument(Block, "sign_block", "ecdsa.sign.block")
+METRICS.instrument(Transaction, "verify_signature", "ecdsa.verify.transaction")
+METRICS.instrument(Block, "verify_block", "ecdsa.verify.block")
+METRICS.instrument(Node, "mine_block", "mining.block")
+METRICS.instrument(Node, "validate_block", "consensus.validate_block")
+METRICS.instrument(PBFTCluster, "_dispatch", "consensus.dispatch")
+METRICS.instrument(Network, "_deliver", "network.deliver")
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99), "max": float(max(values))}
+
+
+def benchmark_consensus(node_counts, aggregate=False, latency=None, seed=0,
+                        output_path="bft_benchmark.jsonl"):
+    """Окремі виміри майнингу, поширення блоку та фіналізації PBFT для кожної кількості вузлів.
+
+    Кожен результат дописується рядком JSON у output_path, щоб порівнювати запуски між собою.
+    """
+    run_id = time.strftime("%Y-%m-%dT%H:%M:%S")
+    results = []
+    for num_nodes in node_counts:
+        transactions = [Transaction(f"sender_{i}", [f"receiver_{i}"], random.uniform(1, 100)) for i in range(5)]
+        start_time = time.perf_counter()
+        block = Node(Blockchain(), 0).mine_block(
+            transactions, difficulty_target=0x00000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF)
+        mining_seconds = time.perf_counter() - start_time
+
+        start_time, start_cpu_time = time.perf_counter(), time.process_time()
+        cluster = pbft_protocol(num_nodes, aggregate, latency, seed, block=block)
+        consensus_seconds = time.perf_counter() - start_time
+        consensus_cpu_seconds = time.process_time() - start_cpu_time
+        # Знімок метрик (якщо увімкнені) - лише майнинг і перший прогін консенсусу
+        metrics = METRICS.snapshot() if METRICS.enabled else None
+        METRICS.reset()
+
+        # Пам'ять міряємо окремим повтором, щоб tracemalloc не спотворював виміри часу
+        tracemalloc.start()
+        pbft_protocol(num_nodes, aggregate, latency, seed, block=block)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        replicas = cluster.replicas
+        received = [replica.block_received_at for replica in replicas if replica.block_received_at is not None]
+        finalized = [replica.finalized_at for replica in replicas if replica.finalized_at is not None]
+        result = {
+            "run_id": run_id,
+            "python": platform.python_version(),
+            "num_nodes": num_nodes,
+            "aggregate": aggregate,
+            "seed": seed,
+            "mining_seconds": mining_seconds,
+            "consensus_cpu_seconds": consensus_cpu_seconds,
+            "consensus_wall_seconds": consensus_seconds,
+            "dissemination_virtual_seconds": _percentiles(received),
+            "finality_virtual_seconds": _percentiles(finalized),
+            "finalized_nodes": len(finalized),
+            "messages": cluster.network.messages_sent,
+            "messages_by_kind": cluster.message_counts,
+            "bytes": sum(cluster.message_bytes.values()),
+            "bytes_by_kind": cluster.message_bytes,
+            "events_processed": cluster.network.events_processed,
+            "peak_memory_bytes": peak_memory,
+            "peak_memory_per_node_bytes": peak_memory / num_nodes,
+        }
+        if metrics is not None:
+            result["metrics"] = metrics
+        results.append(result)
+        if output_path:
+            with open(output_path, "a") as output_file:
+                output_file.write(json.dumps(result) + "\n")
+    return results
 
 
 def measure_time_for_protocol(num_nodes):
@@ -198,14 +750,9 @@ def measure_time_for_protocol(num_nodes):
 
 
 node_counts = [10, 100, 1000]
-execution_times = []
-
-for num_nodes in node_counts:
-    execution_time = measure_time_for_protocol(num_nodes)
-    execution_times.append(execution_time)
 
 
-def plot_execution_time():
+def plot_execution_time(node_counts, execution_times):
     plt.plot(node_counts, execution_times, marker='o')
     plt.title("Час виконання BFT протоколу залежно від кількості вузлів")
     plt.xlabel("Кількість вузлів")
@@ -214,4 +761,26 @@ def plot_execution_time():
     plt.show()
 
 
-plot_execution_time()
+if __name__ == "__main__" and "--metrics" in sys.argv:
+    # python pr5.py --metrics - розподіл часу між гешуванням, ECDSA та консенсусом; знімок у metrics.jsonl
+    METRICS.enable()
+    for num_nodes in node_counts:
+        print(f"\n{num_nodes} вузлів:")
+        METRICS.reset()
+        pbft_protocol(num_nodes)
+        METRICS.report()
+        METRICS.export(METRICS_PATH)
+elif __name__ == "__main__" and "--benchmark" in sys.argv:
+    # python pr5.py --benchmark [--aggregate] [--with-metrics] - виміри за фазами у bft_benchmark.jsonl
+    if "--with-metrics" in sys.argv:
+        METRICS.enable()
+    for result in benchmark_consensus([10, 100, 1000], aggregate="--aggregate" in sys.argv):
+        print(json.dumps(result))
+elif __name__ == "__main__":
+    execution_times = []
+
+    for num_nodes in node_counts:
+        execution_time = measure_time_for_protocol(num_nodes)
+        execution_times.append(execution_time)
+
+    plot_execution_time(node_counts, execution_times)